@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "image_to_thumbnail_rest_api.settings")
+# Media endpoints are served by the async views under ASGI, unless explicitly disabled.
+os.environ.setdefault("IMAGES_ASYNC_MEDIA_VIEWS", "true")
 
 application = get_asgi_application()
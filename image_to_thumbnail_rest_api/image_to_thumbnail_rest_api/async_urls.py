@@ -0,0 +1,13 @@
+"""
+URL configuration serving the media endpoints with the async views, whatever IMAGES_ASYNC_MEDIA_VIEWS is set to.
+Used to compare both serving paths in the same process (tests, benchmark).
+"""
+from django.urls import path, include
+
+from .urls import media_urlpatterns
+
+urlpatterns = [
+    path("images/", include("images.urls")),
+    path("users/", include("users.urls")),
+    *media_urlpatterns(asynchronous=True),
+]
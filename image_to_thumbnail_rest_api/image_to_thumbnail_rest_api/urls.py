@@ -18,22 +18,51 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
 
-from images.views import ExpiringImageView, OpenImageView
+from images.views import (
+    AsyncExpiringImageView,
+    AsyncOpenImageView,
+    AsyncSignedImageView,
+    ExpiringImageView,
+    MetricsView,
+    OpenImageView,
+    SignedImageView,
+)
+
+
+def media_urlpatterns(asynchronous: bool) -> list:
+    """
+    Routes of the media endpoints, served by the async views when `asynchronous` is set.
+    """
+    open_image_view, expiring_image_view, signed_image_view = (
+        (AsyncOpenImageView, AsyncExpiringImageView, AsyncSignedImageView)
+        if asynchronous
+        else (OpenImageView, ExpiringImageView, SignedImageView)
+    )
+    return [
+        path(
+            "media/expiring-images/<str:file_name>",
+            expiring_image_view.as_view(),
+            name="expiring-image-view",
+        ),
+        path(
+            "media/expiring/<str:token>/<str:file_name>",
+            signed_image_view.as_view(),
+            name="signed-image-view",
+        ),
+        path(
+            "media/<int:user_pk>/images/<str:file_name>",
+            open_image_view.as_view(),
+            name="image-access",
+        ),
+    ]
+
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("images/", include("images.urls")),
     path("users/", include("users.urls")),
-    path(
-        "media/expiring-images/<str:file_name>",
-        ExpiringImageView.as_view(),
-        name="expiring-image-view",
-    ),
-    path(
-        "media/<int:user_pk>/images/<str:file_name>",
-        OpenImageView.as_view(),
-        name="image-access",
-    ),
+    path("metrics", MetricsView.as_view(), name="metrics"),
+    *media_urlpatterns(settings.IMAGES_ASYNC_MEDIA_VIEWS),
 ]
 
 if settings.DEBUG:
@@ -1,6 +1,8 @@
 from django.contrib import admin
 
-from images.models import Image, ExpiringImage
+from images.models import Image, ExpiringImage, Rendition, ThumbnailJob
 
 admin.site.register(Image)
 admin.site.register(ExpiringImage)
+admin.site.register(Rendition)
+admin.site.register(ThumbnailJob)
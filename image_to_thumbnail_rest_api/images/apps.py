@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class ImagesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "images"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .metrics import configure_tracing
+        from image_to_thumbnail_rest_api.db import configure_sqlite
+
+        connection_created.connect(configure_sqlite, dispatch_uid="configure_sqlite")
+        configure_tracing()
@@ -0,0 +1,69 @@
+from django.utils import timezone
+
+from .image_processor import tier_thumbnail_heights
+from .models import Image, Rendition, ThumbnailJob
+from .tasks import reuse_renditions, thumbnail_keys, thumbnail_name
+
+
+def image_batches(after_pk: int, batch_size: int, tier_names: list = None):
+    """
+    Yields the images after `after_pk` in primary key order, a batch at a time, with their owner's tier.
+    Each batch is fetched by a keyset query starting after the last image of the previous one.
+    """
+    images = Image.objects.select_related("user__tier").filter(user__tier__isnull=False).order_by("pk")
+    if tier_names:
+        images = images.filter(user__tier__name__in=tier_names)
+    while batch := list(images.filter(pk__gt=after_pk)[:batch_size]):
+        yield batch
+        after_pk = batch[-1].pk
+
+
+def missing_keys(images: list) -> dict:
+    """
+    Returns, by image pk, the (height, format) of the renditions the current tier of the owner generates on upload
+    and the image lacks. Images with a thumbnail job in progress are left to that job.
+    """
+    # Renditions are matched by name: their height is the one of the original when it is smaller than requested.
+    existing = set(Rendition.objects.filter(image__in=images, on_demand=False).values_list("storage_path", flat=True))
+    in_progress = set(
+        ThumbnailJob.objects.filter(
+            image__in=images, status__in=[ThumbnailJob.Status.PENDING, ThumbnailJob.Status.PROCESSING]
+        ).values_list("image_id", flat=True)
+    )
+    missing = {}
+    for image in images:
+        if image.pk in in_progress:
+            continue
+        tier = image.user.tier
+        keys = [
+            (height, image_format)
+            for height, image_format in thumbnail_keys(image, tier_thumbnail_heights(tier), tier.variant_formats)
+            if thumbnail_name(image, height, image_format) not in existing
+        ]
+        if keys:
+            missing[image.pk] = keys
+    return missing
+
+
+def create_backfill_jobs(images: list, claim: bool = True) -> list:
+    """
+    Creates thumbnail jobs rendering the missing renditions of the images, reusing the renditions of images
+    with the same contents when they have them all (such jobs are done at once).
+    Jobs are created claimed, for the caller to process, unless `claim` is False: they are then queued for
+    the thumbnail workers. Claimed jobs left behind by a crash are queued again by the thumbnail workers.
+    """
+    missing = missing_keys(images)
+    now = timezone.now()
+    jobs = []
+    for image in images:
+        if image.pk not in missing:
+            continue
+        tier = image.user.tier
+        sizes = sorted({height for height, _ in missing[image.pk]}, reverse=True)
+        job = ThumbnailJob(image=image, sizes=sizes, formats=tier.variant_formats)
+        if reuse_renditions(image, missing[image.pk]):
+            job.status, job.finished_at = ThumbnailJob.Status.DONE, now
+        elif claim:
+            job.status, job.started_at, job.attempts = ThumbnailJob.Status.PROCESSING, now, 1
+        jobs.append(job)
+    return ThumbnailJob.objects.bulk_create(jobs)
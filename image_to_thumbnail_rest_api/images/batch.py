@@ -0,0 +1,209 @@
+import os
+import tarfile
+import tempfile
+import zipfile
+
+from django.conf import settings
+from django.core.files.base import File
+from django.db import transaction
+from django.utils import timezone
+
+from .image_processor import tier_thumbnail_heights
+from .metadata import image_metadata
+from .metrics import IMAGE_BYTES, STAGE_SECONDS
+from .models import IMAGE_FORMATS, Image, ThumbnailJob
+from .tasks import reuse_renditions, thumbnail_keys, thumbnail_name
+from .uploads import HEADER_MAX_SIZE, inspect_header, upload_limits
+
+from users.models import User
+from users.quotas import QuotaExceeded, release_upload, reserve_upload
+
+# Members of an archive are spooled to disk above this size.
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+class BatchError(Exception):
+    """
+    Raised when the batch as a whole cannot be read.
+    """
+
+
+def _spooled(stream, max_bytes: int) -> File:
+    """
+    Copies at most one byte more than `max_bytes` of the stream, enough to tell the member is too large.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    remaining = max_bytes + 1
+    while remaining > 0 and (chunk := stream.read(min(File.DEFAULT_CHUNK_SIZE, remaining))):
+        spooled.write(chunk)
+        remaining -= len(chunk)
+    spooled.seek(0)
+    return File(spooled)
+
+
+def _check_members(count: int, extracted_bytes: int):
+    if count > settings.IMAGES_BATCH_MAX_FILES:
+        raise BatchError(f"A batch can contain at most {settings.IMAGES_BATCH_MAX_FILES} files")
+    if extracted_bytes > settings.IMAGES_BATCH_MAX_EXTRACTED_BYTES:
+        raise BatchError(f"Archive members must be at most {settings.IMAGES_BATCH_MAX_EXTRACTED_BYTES} bytes in total")
+
+
+def _archive_members(archive, max_bytes: int):
+    """
+    Yields (name, file) of the regular files of a zip or tar archive, one member at a time.
+    Tar archives are read as a stream, compressed or not, so only the current member is ever held.
+    Members are never extracted past `max_bytes`, so a compressed bomb cannot fill the disk. The number of members
+    and their total size are checked against IMAGES_BATCH_MAX_FILES and IMAGES_BATCH_MAX_EXTRACTED_BYTES before
+    anything is extracted from zip archives, and before each member is extracted from tar archives.
+    """
+    if zipfile.is_zipfile(archive):
+        archive.seek(0)
+        with zipfile.ZipFile(archive) as zip_file:
+            infos = [info for info in zip_file.infolist() if not info.is_dir()]
+            _check_members(len(infos), sum(info.file_size for info in infos))
+            for info in infos:
+                with zip_file.open(info) as member:
+                    yield info.filename, _spooled(member, max_bytes)
+        return
+    archive.seek(0)
+    count, extracted_bytes = 0, 0
+    try:
+        with tarfile.open(fileobj=archive, mode="r|*") as tar_file:
+            for info in tar_file:
+                if not info.isfile():
+                    continue
+                count, extracted_bytes = count + 1, extracted_bytes + info.size
+                _check_members(count, extracted_bytes)
+                yield info.name, _spooled(tar_file.extractfile(info), max_bytes)
+    except tarfile.TarError:
+        raise BatchError("Archive must be a zip or tar file")
+
+
+def batch_files(files: list, archive, max_bytes: int):
+    """
+    Yields (name, file) of every uploaded file, followed by the contents of the archive, if one was uploaded.
+    """
+    for uploaded_file in files:
+        yield uploaded_file.name, uploaded_file
+    if archive is not None:
+        yield from _archive_members(archive, max_bytes)
+
+
+def _validation_error(name: str, file, max_bytes: int, max_pixels: int) -> str | None:
+    if file.size > max_bytes:
+        return f"Image must be at most {max_bytes} bytes"
+    file.seek(0)
+    header = file.read(HEADER_MAX_SIZE)
+    file.seek(0)
+    return inspect_header(name, header, max_pixels, complete=len(header) < HEADER_MAX_SIZE)[0]
+
+
+def _result(image_instance: Image, job: ThumbnailJob, sizes: list) -> dict:
+    storage = image_instance.original_image.storage
+    data = {
+        "pk": image_instance.pk,
+        "job": job.pk,
+        "status": job.status,
+        "thumbnails": {
+            f"{size}px_thumbnail": storage.url(thumbnail_name(image_instance, size))
+            for size in sizes
+        },
+    }
+    if image_instance.user.tier.presence_of_original_file_link:
+        data["original_image"] = image_instance.original_image.url
+    return data
+
+
+def _discard(images: list):
+    """
+    Deletes the stored originals of a batch that failed, giving back the quotas they were counted against.
+    """
+    for image_instance in images:
+        if image_instance.original_image._committed:
+            image_instance.original_image.delete(save=False)
+        release_upload(
+            image_instance.user_id, image_instance.width * image_instance.height, image_instance.byte_size
+        )
+
+
+def upload_batch(user: User, files) -> list:
+    """
+    Stores every valid image of the batch and queues its thumbnails, returns one result per file in upload order.
+    Invalid files, and files over a quota of the user's tier, are reported with an error and do not prevent
+    the others from being stored.
+    Images and thumbnail jobs are inserted with one query each, thumbnails are rendered by the thumbnail workers
+    unless an image with the same contents already has them.
+    """
+    max_bytes, max_pixels = upload_limits(user.tier)
+    results, images = [], []
+    # Names given to the originals of the batch, which are only inserted at the end.
+    names = set()
+    try:
+        for count, (name, file) in enumerate(files):
+            if count >= settings.IMAGES_BATCH_MAX_FILES:
+                raise BatchError(f"A batch can contain at most {settings.IMAGES_BATCH_MAX_FILES} files")
+            file_name = os.path.basename(name)
+            error = _validation_error(file_name, file, max_bytes, max_pixels)
+            if error:
+                results.append({"file": file_name, "error": error})
+                continue
+            file.name = file_name
+            image_format = IMAGE_FORMATS[os.path.splitext(file_name)[1].lower()]
+            labels = {"tier": user.tier.name, "height": "", "format": image_format}
+            try:
+                with STAGE_SECONDS.time(stage="metadata", **labels):
+                    metadata = image_metadata(file)
+            except OSError:
+                results.append({"file": file_name, "error": "Upload a valid image"})
+                continue
+            try:
+                reserve_upload(user, metadata["width"] * metadata["height"], metadata["byte_size"])
+            except QuotaExceeded as e:
+                result = {"file": file_name, "error": str(e)}
+                if e.retry_after is not None:
+                    result["retry_after"] = e.retry_after
+                results.append(result)
+                continue
+            image_instance = Image(user=user, original_image=file, format=image_format, **metadata)
+            images.append(image_instance)
+            with STAGE_SECONDS.time(stage="save", **labels):
+                image_instance.commit_original(names)
+            IMAGE_BYTES.inc(file.size, direction="in", tier=user.tier.name, format=image_instance.format)
+            results.append({"file": file_name, "image": image_instance})
+    except Exception:
+        _discard(images)
+        raise
+
+    sizes, formats = tier_thumbnail_heights(user.tier), user.tier.variant_formats
+    try:
+        with transaction.atomic():
+            Image.objects.bulk_create(images)
+            # Jobs are done at once without sizes, or when an image with the same contents has the thumbnails.
+            done = {
+                image_instance.pk
+                for image_instance in images
+                if not sizes or reuse_renditions(image_instance, thumbnail_keys(image_instance, sizes, formats))
+            }
+            jobs = ThumbnailJob.objects.bulk_create(
+                [
+                    ThumbnailJob(image=image_instance, sizes=sizes, formats=formats)
+                    if image_instance.pk not in done
+                    else ThumbnailJob(
+                        image=image_instance,
+                        sizes=sizes,
+                        formats=formats,
+                        status=ThumbnailJob.Status.DONE,
+                        finished_at=timezone.now(),
+                    )
+                    for image_instance in images
+                ]
+            )
+    except Exception:
+        _discard(images)
+        raise
+    jobs = dict(zip((image_instance.pk for image_instance in images), jobs))
+    for result in results:
+        image_instance = result.pop("image", None)
+        if image_instance is not None:
+            result.update(_result(image_instance, jobs[image_instance.pk], sizes))
+    return results
@@ -0,0 +1,130 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Sum
+from django.utils import timezone
+
+from .image_processor import tier_thumbnail_heights
+from .metrics import IMAGE_BYTES, STAGE_SECONDS, observe_render
+from .models import Image, Rendition
+from .renditions import RenditionEngine, supported_formats
+from .tasks import reuse_renditions, store_rendition, thumbnail_name, tier_name
+
+from users.models import Tier
+
+OUTPUT_FORMATS = {"jpeg": "JPEG", "jpg": "JPEG", "png": "PNG", "webp": "WEBP"}
+if "AVIF" in supported_formats():
+    OUTPUT_FORMATS["avif"] = "AVIF"
+
+
+def allowed_heights(tier: Tier | None) -> set:
+    """
+    Returns the heights the tier may request on demand: its upload sizes and its on-demand allow-list.
+    """
+    if tier is None:
+        return set()
+    return set(tier_thumbnail_heights(tier)) | set(tier.on_demand_heights)
+
+
+def touch(rendition: Rendition):
+    """
+    Records an access to the rendition for LRU eviction.
+    The row is written at most once per IMAGES_DERIVATIVE_TOUCH_INTERVAL, not on every hit.
+    """
+    now = timezone.now()
+    if rendition.last_accessed_at < now - timedelta(seconds=settings.IMAGES_DERIVATIVE_TOUCH_INTERVAL):
+        Rendition.objects.filter(pk=rendition.pk).update(last_accessed_at=now)
+
+
+async def atouch(rendition: Rendition):
+    """
+    Asynchronous `touch`.
+    """
+    now = timezone.now()
+    if rendition.last_accessed_at < now - timedelta(seconds=settings.IMAGES_DERIVATIVE_TOUCH_INTERVAL):
+        await Rendition.objects.filter(pk=rendition.pk).aupdate(last_accessed_at=now)
+
+
+def render_derivative(image: Image, height: int, image_format: str = None) -> Rendition | None:
+    """
+    Returns the rendition of given height and format, rendering it if it does not exist yet.
+    Returns None, without waiting, while another request is rendering it.
+    """
+    storage_path = thumbnail_name(image, height, image_format)
+    lock_key = f"images:derivative:{storage_path}"
+    if not cache.add(lock_key, 1, settings.IMAGES_DERIVATIVE_LOCK_TIMEOUT):
+        return None
+    try:
+        try:
+            return Rendition.objects.get(storage_path=storage_path)
+        except ObjectDoesNotExist:
+            pass
+        reused = reuse_renditions(image, [(height, image_format or image.format)], on_demand=True)
+        if reused:
+            return reused[0]
+        with image.original_image.open("rb") as original_image:
+            result = RenditionEngine().render(original_image, [height], image_format)
+        tier, rendition = tier_name(image), result["renditions"][height]
+        observe_render(result["timings"], tier, rendition["format"])
+        with STAGE_SECONDS.time(stage="store", tier=tier, height=height, format=rendition["format"]):
+            rendition_instance = store_rendition(image, storage_path, rendition, on_demand=True)
+        IMAGE_BYTES.inc(len(rendition["content"]), direction="out", tier=tier, format=rendition["format"])
+        return rendition_instance
+    finally:
+        cache.delete(lock_key)
+
+
+def nearest_rendition(image: Image, height: int) -> Rendition | None:
+    """
+    Returns the existing rendition of the image closest to the height, the smallest larger one if any.
+    """
+    renditions = Rendition.objects.select_related("blob").filter(image=image)
+    return renditions.filter(height__gte=height).order_by("height").first() or renditions.order_by("-height").first()
+
+
+def get_or_create_derivative(image: Image, height: int, image_format: str = None) -> tuple:
+    """
+    Returns the rendition of given height and format, rendering it if it does not exist yet, and whether it is
+    the requested one. Concurrent misses for the same rendition are coalesced: one request renders it, the others
+    wait at most IMAGES_DERIVATIVE_WAIT seconds for it, then get the nearest existing rendition of the image
+    (None without any) rather than hold their worker for the whole render.
+    """
+    storage_path = thumbnail_name(image, height, image_format)
+    deadline = time.monotonic() + settings.IMAGES_DERIVATIVE_WAIT
+    while True:
+        rendition = render_derivative(image, height, image_format)
+        if rendition is not None:
+            return rendition, True
+        if time.monotonic() >= deadline:
+            return nearest_rendition(image, height), False
+        time.sleep(0.05)
+        rendition = Rendition.objects.select_related("blob").filter(storage_path=storage_path).first()
+        if rendition is not None:
+            return rendition, True
+
+
+def evict_derivatives(max_bytes: int, batch_size: int) -> tuple:
+    """
+    Deletes the least recently accessed on-demand renditions until they take up at most `max_bytes`.
+    Files are deleted along with the last rendition using them.
+    Returns the number of deleted renditions and the number of bytes they took up.
+    """
+    derivatives = Rendition.objects.filter(on_demand=True)
+    total = derivatives.aggregate(total=Sum("byte_size"))["total"] or 0
+    deleted, bytes_freed = 0, 0
+    while total > max_bytes:
+        batch = []
+        for pk, byte_size in derivatives.order_by("last_accessed_at").values_list("pk", "byte_size")[:batch_size]:
+            if total <= max_bytes:
+                break
+            batch.append(pk)
+            total -= byte_size
+            bytes_freed += byte_size
+        if not batch:
+            break
+        Rendition.objects.filter(pk__in=batch).delete()
+        deleted += len(batch)
+    return deleted, bytes_freed
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.storage import Storage
+
+from .metrics import CACHE_REQUESTS
+from .models import Rendition
+from .responses import content_type_for
+
+
+def thumbnail_file(storage: Storage, rendition: Rendition) -> dict | None:
+    """
+    Reads the rendition with what is needed to serve it, for the hot cache.
+    Returns None when the rendition is too large to be cached or its file is missing.
+    """
+    if rendition.byte_size > settings.IMAGES_HOT_CACHE_MAX_ITEM_BYTES:
+        return None
+    try:
+        with storage.open(rendition.file_name, "rb") as file:
+            content = file.read()
+    except FileNotFoundError:
+        return None
+    return {
+        "content": content,
+        "content_type": content_type_for(rendition.file_name),
+        "etag": rendition.checksum,
+        "last_modified": int(rendition.created_at.timestamp()),
+    }
+
+
+class HotCache:
+    """
+    Small thumbnails held in memory, so that the most requested ones are served without database or storage access.
+    An LRU of the process, bounded in bytes, sits in front of a Django cache shared by the processes.
+
+    The entry of a thumbnail holds the formats of its variants and the files (see `thumbnail_file`) served so far,
+    by format (None for the thumbnail itself). Thumbnails and their variants share an entry, keyed by their
+    storage name without extension, so that a change to any of them invalidates it.
+    Invalidations reach the shared cache at once, other processes drop their copy after IMAGES_HOT_CACHE_TIMEOUT.
+    """
+
+    def __init__(self):
+        self.__entries = OrderedDict()
+        self.__size = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.IMAGES_HOT_CACHE_MAX_ITEM_BYTES > 0
+
+    @property
+    def shared(self):
+        alias = settings.IMAGES_HOT_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def key(self, name: str) -> str:
+        # Hashed, as storage names may be longer or contain characters some cache backends do not accept in keys.
+        return f"images:hot:{hashlib.sha1(os.path.splitext(name)[0].encode()).hexdigest()}"
+
+    @staticmethod
+    def __entry_size(entry: dict) -> int:
+        return sum(len(file["content"]) for file in entry["files"].values())
+
+    def __pop(self, key: str):
+        item = self.__entries.pop(key, None)
+        if item is not None:
+            self.__size -= self.__entry_size(item[0])
+
+    def __get_local(self, key: str) -> dict | None:
+        with self.__lock:
+            item = self.__entries.get(key)
+            if item is None:
+                return None
+            entry, expires_at = item
+            if expires_at <= time.monotonic():
+                self.__pop(key)
+                return None
+            self.__entries.move_to_end(key)
+            return entry
+
+    def __set_local(self, key: str, entry: dict):
+        max_bytes = settings.IMAGES_HOT_CACHE_MAX_BYTES
+        size = self.__entry_size(entry)
+        with self.__lock:
+            self.__pop(key)
+            if size > max_bytes:
+                return
+            self.__entries[key] = (entry, time.monotonic() + settings.IMAGES_HOT_CACHE_TIMEOUT)
+            self.__size += size
+            while self.__size > max_bytes:
+                self.__pop(next(iter(self.__entries)))
+
+    def __found(self, name: str, key: str, entry: dict | None, cache: str) -> dict | None:
+        # Names differing only by their extension share a key, the entry of one is a miss for the others.
+        if entry is not None and entry["name"] != name:
+            entry = None
+        CACHE_REQUESTS.inc(cache=cache, result="miss" if entry is None else "hit")
+        if entry is not None and cache == "hot_shared":
+            self.__set_local(key, entry)
+        return entry
+
+    def get(self, name: str) -> dict | None:
+        """
+        Returns the entry of the thumbnail stored under the name, if cached.
+        """
+        key = self.key(name)
+        entry = self.__found(name, key, self.__get_local(key), "hot_local")
+        if entry is None and self.shared:
+            entry = self.__found(name, key, self.shared.get(key), "hot_shared")
+        return entry
+
+    async def aget(self, name: str) -> dict | None:
+        """
+        Asynchronous `get`.
+        """
+        key = self.key(name)
+        entry = self.__found(name, key, self.__get_local(key), "hot_local")
+        if entry is None and self.shared:
+            entry = self.__found(name, key, await self.shared.aget(key), "hot_shared")
+        return entry
+
+    def __added(self, name: str, formats: list, image_format: str | None, file: dict) -> tuple:
+        key = self.key(name)
+        entry = self.__get_local(key)
+        files = entry["files"] if entry and entry["name"] == name and entry["formats"] == formats else {}
+        # A new entry rather than an update of the cached one, which other threads may be reading.
+        entry = {"name": name, "formats": formats, "files": {**files, image_format: file}}
+        self.__set_local(key, entry)
+        return key, entry
+
+    def add(self, name: str, formats: list, image_format: str | None, file: dict):
+        """
+        Caches the file served for the thumbnail stored under the name, the formats being those of its variants.
+        """
+        key, entry = self.__added(name, formats, image_format, file)
+        if self.shared:
+            self.shared.set(key, entry, settings.IMAGES_HOT_CACHE_SHARED_TIMEOUT)
+
+    async def aadd(self, name: str, formats: list, image_format: str | None, file: dict):
+        """
+        Asynchronous `add`.
+        """
+        key, entry = self.__added(name, formats, image_format, file)
+        if self.shared:
+            await self.shared.aset(key, entry, settings.IMAGES_HOT_CACHE_SHARED_TIMEOUT)
+
+    def invalidate(self, name: str):
+        """
+        Drops the entry of the thumbnail, or variant, stored under the name.
+        """
+        key = self.key(name)
+        with self.__lock:
+            self.__pop(key)
+        if self.shared:
+            self.shared.delete(key)
+
+    def clear(self):
+        """
+        Drops the entries of the process.
+        """
+        with self.__lock:
+            self.__entries.clear()
+            self.__size = 0
+
+
+hot_cache = HotCache()
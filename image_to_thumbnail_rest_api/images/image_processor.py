@@ -1,125 +1,71 @@
-import os
 from rest_framework import status
 from rest_framework.request import Request
 from rest_framework.response import Response
 
-from .models import Image, ExpiringImage
-from PIL import Image as PILImage
+from .models import Image
+from .signing import expiring_link
+from .tasks import enqueue_thumbnails, thumbnail_name
 
+from users.models import Tier
 
-class ImageProcessor:
-
-    def __image_processing(self, request: Request, image_instance: Image, image: PILImage, size: int) -> tuple:
-        """
-        Processes image, returns file url and file extension.
-        """
-        original_image_url = image_instance.original_image.url
-        image_url, image_extension = os.path.splitext(original_image_url)
-        image.thumbnail((image.width, size))
-        image.save(f".{image_url}_{size}px_thumbnail{image_extension}")
-        return image_url, image_extension
+def tier_thumbnail_heights(tier: Tier) -> list:
+    """
+    Returns the thumbnail heights generated on upload for the tier.
+    """
+    if tier.thumbnail_heights:
+        return tier.thumbnail_heights
+    return [tier.thumbnail_height] if tier.thumbnail_height else []
 
-    def basic_tier_processing(self, request: Request, image_instance: Image, image: PILImage) -> Response:
-        """
-        Basic tier processing.
-        """
-        image_url, image_extension = self.__image_processing(
-            request, image_instance, image, 200
-        )
-        data = {
-            "200px_thumbnail": f"{image_url}_200px_thumbnail{image_extension}",
-            "success": "Image uploaded successfully",
-        }
-        return Response(data, status=status.HTTP_201_CREATED)
 
-    def premium_tier_processing(self, request: Request, image_instance: Image, image: PILImage) -> Response:
-        """
-        Premium tier processing.
-        """
-        image_url, image_extension = self.__image_processing(
-            request, image_instance, image, 400
+def validate_live_time(data) -> tuple:
+    """
+    Returns the live_time from request data and an error response, if it is missing or out of range.
+    """
+    try:
+        live_time = data["live_time"]
+    except KeyError:
+        return None, Response(
+            {"error": "No live_time field"}, status=status.HTTP_400_BAD_REQUEST
         )
-        image_url, image_extension = self.__image_processing(
-            request, image_instance, image, 200
+    try:
+        live_time = int(live_time)
+    except (TypeError, ValueError):
+        live_time = None
+    if live_time is None or live_time < 300 or live_time > 3000:
+        return None, Response(
+            {"error": "Live time must be between 300 and 3000 seconds"},
+            status=status.HTTP_400_BAD_REQUEST,
         )
-        data = {
-            "400px_thumbnail": f"{image_url}_400px_thumbnail{image_extension}",
-            "200px_thumbnail": f"{image_url}_200px_thumbnail{image_extension}",
-            "original_image": image_instance.original_image.url,
-            "success": "Image uploaded successfully",
-        }
-        return Response(data, status=status.HTTP_201_CREATED)
+    return live_time, None
+
+
+class ImageProcessor:
 
-    def enterprise_tier_processing(self, request: Request, image_instance: Image, image: PILImage) -> Response:
+    def __image_processing(self, request: Request, image_instance: Image, tier: Tier) -> dict:
         """
-        Enterprise tier processing.
+        Queues thumbnail generation, returns job data with the (pending) thumbnail urls.
         """
-        try:
-            live_time = request.data["live_time"]
-        except KeyError:
-            return Response(
-                {"error": "No live_time field"}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if int(live_time) < 300 or int(live_time) > 3000:
-            return Response(
-                {"error": "Live time must be between 300 and 3000 seconds"},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-        original_image_url = image_instance.original_image.url
-        image_url, image_extension = self.__image_processing(
-            request, image_instance, image, 400
-        )
-        image_url, image_extension = self.__image_processing(
-            request, image_instance, image, 200
-        )
-        image_name = os.path.splitext(os.path.basename(original_image_url))[0]
-        expiring_image = ExpiringImage.objects.create(
-            user=request.user, live_time=live_time
-        )
-        expiring_image.image.save(
-            f"{image_name}{image_extension}", image_instance.original_image
-        )
+        sizes = tier_thumbnail_heights(tier)
+        job = enqueue_thumbnails(image_instance, sizes, tier.variant_formats)
+        storage = image_instance.original_image.storage
         data = {
-            "400px_thumbnail": f"{image_url}_400px_thumbnail{image_extension}",
-            "200px_thumbnail": f"{image_url}_200px_thumbnail{image_extension}",
-            "original_image": original_image_url,
-            f"{live_time}s_expiring_link": expiring_image.image.url,
-            "success": "Image uploaded successfully",
+            f"{size}px_thumbnail": storage.url(thumbnail_name(image_instance, size))
+            for size in sizes
         }
-        return Response(data, status=status.HTTP_201_CREATED)
+        data["job"] = job.pk
+        data["status"] = job.status
+        return data
 
-    def default_tier_processing(self, request: Request, image_instance: Image, image: PILImage) -> Response:
+    def process(self, request: Request, image_instance: Image, live_time: int | None = None) -> Response:
         """
-        Default tier processing. (for arbitrary tiers)
+        Tier processing, driven by the tier's thumbnail heights, formats and flags.
+        `live_time` is that of the expiring link, validated by the view for tiers with the ability to fetch one.
         """
-        user = request.user
-        image_url, image_extension = self.__image_processing(
-            request, image_instance, image, user.tier.thumbnail_height
-        )
-        image_name = os.path.basename(image_url)
-        data = {
-            f"{str(user.tier.thumbnail_height)}px_thumbnail": f"{image_url}_{str(user.tier.thumbnail_height)}px_thumbnail{image_extension}"
-        }
-        if user.tier.presence_of_original_file_link:
+        tier = request.user.tier
+        data = self.__image_processing(request, image_instance, tier)
+        if tier.presence_of_original_file_link:
             data["original_image"] = image_instance.original_image.url
-        if user.tier.ability_to_fetch_expiring_link:
-            try:
-                live_time = request.data["live_time"]
-            except KeyError:
-                return Response(
-                    {"error": "No live_time field"}, status=status.HTTP_400_BAD_REQUEST
-                )
-            if int(live_time) < 300 or int(live_time) > 3000:
-                return Response(
-                    {"error": "Live time must be between 300 and 3000 seconds"},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            expiring_image = ExpiringImage.objects.create(
-                user=user, live_time=live_time
-            )
-            expiring_image.image.save(
-                f"{image_name}{image_extension}", image_instance.original_image
-            )
-            data[f"{live_time}s_expiring_link"] = expiring_image.image.url
+        if tier.ability_to_fetch_expiring_link:
+            data[f"{live_time}s_expiring_link"] = expiring_link(image_instance, live_time)[0]
         data["success"] = "Image uploaded successfully"
-        return Response(data, status=status.HTTP_201_CREATED)
+        return Response(data, status=status.HTTP_202_ACCEPTED)
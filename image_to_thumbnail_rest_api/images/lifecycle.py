@@ -0,0 +1,149 @@
+import posixpath
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import Storage, default_storage
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from .models import Blob, ExpiringImage, Image, Rendition
+
+from users.models import Tier
+from users.quotas import release_storage
+
+# Releases collected from the delete signals of the current thread, while a batch is being deleted.
+_pending = threading.local()
+
+
+def defer_release(blob_id: int = None, file_name: str = None, byte_size: int = 0) -> bool:
+    """
+    Records the release of a blob, or the deletion of a file without blob, for the batch being deleted.
+    Returns False when no batch is being deleted, the caller then releases it right away.
+    """
+    pending = getattr(_pending, "value", None)
+    if pending is None:
+        return False
+    if blob_id:
+        pending["blobs"][blob_id] += 1
+    else:
+        pending["files"].append((file_name, byte_size))
+    return True
+
+
+def defer_usage(user_id: int, byte_size: int) -> bool:
+    """
+    Records a deleted image, to be taken off its owner's storage usage along with the rest of the batch.
+    Returns False when no batch is being deleted, the caller then updates the usage right away.
+    """
+    pending = getattr(_pending, "value", None)
+    if pending is None:
+        return False
+    pending["usage"][user_id][0] += byte_size
+    pending["usage"][user_id][1] += 1
+    return True
+
+
+@contextmanager
+def _deferred_releases():
+    _pending.value = pending = {"blobs": Counter(), "files": [], "usage": defaultdict(lambda: [0, 0])}
+    try:
+        yield pending
+    finally:
+        _pending.value = None
+
+
+def unlink_files(storage: Storage, names: list):
+    """
+    Deletes the files in parallel, IMAGES_DELETE_WORKERS at a time. Missing files are ignored by the storages.
+    """
+    if not names:
+        return
+    with ThreadPoolExecutor(max_workers=min(settings.IMAGES_DELETE_WORKERS, len(names))) as executor:
+        list(executor.map(storage.delete, names))
+
+
+def delete_images(images: QuerySet, batch_size: int = 500) -> tuple:
+    """
+    Deletes the images, with their renditions and thumbnail jobs, one batch of rows at a time.
+    The blobs of a batch are released together, and the files left without references are deleted
+    in parallel once the batch is committed. Returns the number of deleted images and of freed bytes.
+    """
+    deleted, bytes_freed = 0, 0
+    while pks := list(images.order_by("pk").values_list("pk", flat=True)[:batch_size]):
+        with transaction.atomic():
+            with _deferred_releases() as pending:
+                Image.objects.filter(pk__in=pks).delete()
+            names, blob_bytes = Blob.release_many(pending["blobs"])
+            for user_id, (byte_size, count) in pending["usage"].items():
+                release_storage(user_id, byte_size, count)
+            names += [file_name for file_name, _ in pending["files"]]
+            transaction.on_commit(lambda names=names: unlink_files(default_storage, names))
+        deleted += len(pks)
+        bytes_freed += blob_bytes + sum(byte_size for _, byte_size in pending["files"])
+    return deleted, bytes_freed
+
+
+def apply_retention(batch_size: int) -> tuple:
+    """
+    Deletes the images older than the retention period of their owner's tier.
+    Returns the number of deleted images and of freed bytes.
+    """
+    deleted, bytes_freed = 0, 0
+    for tier in Tier.objects.filter(retention_days__isnull=False):
+        expired = Image.objects.filter(
+            user__tier=tier, created_at__lt=timezone.now() - timedelta(days=tier.retention_days)
+        )
+        tier_deleted, tier_bytes_freed = delete_images(expired, batch_size)
+        deleted += tier_deleted
+        bytes_freed += tier_bytes_freed
+    return deleted, bytes_freed
+
+
+def walk_storage(storage: Storage, path: str = ""):
+    """
+    Yields the names of the files under `path`, one directory listing at a time.
+    """
+    directories, files = storage.listdir(path)
+    for file_name in files:
+        yield posixpath.join(path, file_name)
+    for directory in directories:
+        yield from walk_storage(storage, posixpath.join(path, directory))
+
+
+def _referenced(names: list) -> set:
+    """
+    Returns the names of the files referenced by a row: blobs, the originals and renditions stored before
+    deduplication (without blob), and expiring images.
+    """
+    return {
+        *Blob.objects.filter(storage_path__in=names).values_list("storage_path", flat=True),
+        *Image.objects.filter(blob__isnull=True, original_image__in=names).values_list("original_image", flat=True),
+        *Rendition.objects.filter(blob__isnull=True, storage_path__in=names).values_list("storage_path", flat=True),
+        *ExpiringImage.objects.filter(image__in=names).values_list("image", flat=True),
+    }
+
+
+def find_orphans(storage: Storage, min_age: int, chunk_size: int = 1000):
+    """
+    Yields the names and sizes of the files in storage that no row references, checking them a chunk at a time.
+    Files younger than `min_age` seconds are skipped: their row may not be committed yet.
+    Files written before deduplication and no longer used by any blob are orphans too.
+    """
+    cutoff = timezone.now() - timedelta(seconds=min_age)
+    names = walk_storage(storage)
+    while chunk := [name for _, name in zip(range(chunk_size), names)]:
+        referenced = _referenced(chunk)
+        for name in chunk:
+            if name in referenced:
+                continue
+            try:
+                if storage.get_modified_time(name) > cutoff:
+                    continue
+                yield name, storage.size(name)
+            except FileNotFoundError:
+                continue
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from images.lifecycle import apply_retention
+
+
+class Command(BaseCommand):
+    help = "Deletes images older than the retention period of their owner's tier, with their thumbnails and files."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Maximum number of images deleted per batch.")
+        parser.add_argument("--loop", action="store_true", help="Keep running, applying retention every --interval seconds.")
+        parser.add_argument("--interval", type=float, default=3600.0, help="Seconds to sleep between runs with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            deleted, bytes_freed = apply_retention(options["batch_size"])
+            self.stdout.write(f"Deleted {deleted} images past retention, freed {bytes_freed} bytes")
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
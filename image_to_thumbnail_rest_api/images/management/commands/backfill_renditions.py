@@ -0,0 +1,96 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from images.backfill import create_backfill_jobs, image_batches
+from images.metrics import REGISTRY
+from images.models import BackfillCheckpoint, ThumbnailJob
+from images.workers import close_connections, init_worker, run_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders the thumbnails images lack for the current tier of their owner, e.g. after a tier was edited "
+        "or users were moved to another tier. Images are scanned in primary key order and the progress is "
+        "checkpointed after every batch, so an interrupted run resumes where it stopped; a completed run starts over."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tiers", nargs="+", default=None, help="Only backfill images of users of these tiers.")
+        parser.add_argument("--batch-size", type=int, default=500, help="Images scanned per batch.")
+        parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (defaults to CPU count).")
+        parser.add_argument("--max-rate", type=float, default=0, help="Maximum jobs started per second, 0 for no limit.")
+        parser.add_argument(
+            "--max-pending",
+            type=int,
+            default=100,
+            help="Wait while more thumbnail jobs than this are queued, so uploads are served first.",
+        )
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to wait for the queue to drain.")
+        parser.add_argument("--checkpoint", default="default", help="Name of the checkpoint to resume from.")
+        parser.add_argument("--restart", action="store_true", help="Start over from the first image.")
+        parser.add_argument(
+            "--enqueue", action="store_true", help="Queue the jobs for the thumbnail workers instead of processing them."
+        )
+
+    def __throttle(self, max_rate: float):
+        """
+        Spaces job starts by 1 / max_rate seconds.
+        """
+        if not max_rate:
+            return
+        now = time.monotonic()
+        if self.__next_start > now:
+            time.sleep(self.__next_start - now)
+        self.__next_start = max(self.__next_start, now) + 1 / max_rate
+
+    def __wait_for_queue(self, max_pending: int, poll_interval: float):
+        while ThumbnailJob.objects.filter(status=ThumbnailJob.Status.PENDING).count() > max_pending:
+            time.sleep(poll_interval)
+
+    def handle(self, *args, **options):
+        checkpoint, _ = BackfillCheckpoint.objects.get_or_create(name=options["checkpoint"])
+        if options["restart"] or not checkpoint.last_image_id:
+            checkpoint.last_image_id = checkpoint.images_scanned = checkpoint.jobs_created = 0
+            checkpoint.save()
+        else:
+            self.stdout.write(f"Resuming after image {checkpoint.last_image_id}")
+        self.__next_start = time.monotonic()
+        close_connections()
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=init_worker) as executor:
+            for batch in image_batches(checkpoint.last_image_id, options["batch_size"], options["tiers"]):
+                self.__wait_for_queue(options["max_pending"], options["poll_interval"])
+                jobs = create_backfill_jobs(batch, claim=not options["enqueue"])
+                claimed = [job.pk for job in jobs if job.status == ThumbnailJob.Status.PROCESSING]
+                # Pool processes are forked on submit, they must not inherit the connection.
+                close_connections()
+                futures = []
+                for job_id in claimed:
+                    self.__throttle(options["max_rate"])
+                    futures.append(executor.submit(run_job, job_id))
+                for job_id, future in zip(claimed, futures):
+                    try:
+                        job_status, metrics = future.result()
+                        REGISTRY.merge(metrics)
+                    except Exception as e:
+                        job_status = f"{ThumbnailJob.Status.FAILED} ({e})"
+                    if job_status != ThumbnailJob.Status.DONE:
+                        self.stderr.write(f"Thumbnail job {job_id}: {job_status}")
+                # Only batches whose jobs all finished are checkpointed.
+                checkpoint.last_image_id = batch[-1].pk
+                checkpoint.images_scanned += len(batch)
+                checkpoint.jobs_created += len(jobs)
+                checkpoint.save()
+                self.stdout.write(
+                    f"Scanned {checkpoint.images_scanned} images up to {checkpoint.last_image_id}, "
+                    f"created {checkpoint.jobs_created} jobs"
+                )
+        # The next run scans every image again.
+        checkpoint.last_image_id = 0
+        checkpoint.save()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Backfill done: scanned {checkpoint.images_scanned} images, created {checkpoint.jobs_created} jobs"
+            )
+        )
@@ -0,0 +1,368 @@
+import asyncio
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import django
+import PIL
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from PIL import Image as PILImage
+
+from images.models import Image, ThumbnailJob
+from images.tasks import process_thumbnail_job
+from users.models import Tier, User
+
+TIERS = {
+    "Basic": [200],
+    "Premium": [400, 200],
+    "Enterprise": [400, 200],
+}
+ASPECT_RATIO = 4 / 3
+
+
+class PeakMemory:
+    """
+    Samples the resident set size of the process in a background thread and keeps the highest value.
+    Pillow allocates pixel data outside of the Python allocator, so tracemalloc would not see it.
+    """
+
+    interval = 0.005
+
+    def __init__(self):
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.peak = 0
+        self.__running = False
+
+    def __rss(self) -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self.page_size
+        except OSError:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def __sample(self):
+        while self.__running:
+            self.peak = max(self.peak, self.__rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.baseline = self.__rss()
+        self.peak = self.baseline
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__sample, daemon=True)
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.__running = False
+        self.__thread.join()
+        self.peak = max(self.peak, self.__rss())
+
+    @property
+    def delta(self) -> int:
+        return self.peak - self.baseline
+
+
+def summarize(samples: list) -> dict:
+    """
+    Returns latency statistics (in seconds) of the samples.
+    """
+    ordered = sorted(samples)
+    percentiles = statistics.quantiles(ordered, n=100, method="inclusive") if len(ordered) > 1 else ordered * 99
+    return {
+        "n": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "min": ordered[0],
+        "p50": percentiles[49],
+        "p95": percentiles[94],
+        "p99": percentiles[98],
+        "max": ordered[-1],
+    }
+
+
+def synthetic_image(megapixels: float, image_format: str) -> bytes:
+    """
+    Returns an encoded image of about `megapixels` with gradients and noise, so it compresses like a photo.
+    """
+    height = int((megapixels * 1_000_000 / ASPECT_RATIO) ** 0.5)
+    width = int(height * ASPECT_RATIO)
+    gradient = PILImage.linear_gradient("L").resize((width, height))
+    noise = PILImage.effect_noise((width, height), 48)
+    image = PILImage.merge("RGB", (gradient, noise, gradient.transpose(PILImage.Transpose.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=90)
+    return buffer.getvalue()
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks uploads, thumbnail processing per tier and media serving on synthetic images. "
+        "Runs against a throwaway test database and media directory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--megapixels", type=float, nargs="+", default=[0.3, 2, 12, 24, 50], help="Input resolutions.")
+        parser.add_argument("--formats", nargs="+", default=["JPEG", "PNG"], choices=["JPEG", "PNG"], help="Input formats.")
+        parser.add_argument("--tiers", nargs="+", default=list(TIERS), choices=list(TIERS), help="Tiers to process with.")
+        parser.add_argument("--repeat", type=int, default=3, help="Uploads per input and tier.")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per serving scenario.")
+        parser.add_argument(
+            "--concurrency", type=int, default=50, help="Requests in flight in the concurrent serving scenarios."
+        )
+        parser.add_argument(
+            "--upload-concurrency",
+            type=int,
+            nargs="+",
+            default=[1, 8],
+            help="Concurrent uploads of the upload load scenarios.",
+        )
+        parser.add_argument("--uploads", type=int, default=50, help="Uploads per upload load scenario.")
+        parser.add_argument("--output", help="Write results as JSON to this file.")
+        parser.add_argument("--compare", help="JSON results of a previous run to compare p50 latencies with.")
+
+    def handle(self, *args, **options):
+        old_database_name = connection.settings_dict["NAME"]
+        media_root = tempfile.mkdtemp(prefix="bench-media-")
+        if connection.vendor == "sqlite":
+            # Concurrent writes are measured against a database file, in WAL mode as in production.
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(media_root, "bench.sqlite3")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(MEDIA_ROOT=media_root, IMAGES_SENDFILE_BACKEND=None):
+                results = self.__run(options)
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                self.__compare(json.load(f), results)
+
+    def __run(self, options: dict) -> dict:
+        results = {
+            "revision": git_revision(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "pillow": PIL.__version__,
+                "machine": platform.machine(),
+                "cpu_count": os.cpu_count(),
+                "database": connection.vendor,
+            },
+            "processing": {},
+            "serving": {},
+            "uploads": {},
+        }
+        served_image = None
+        for image_format in options["formats"]:
+            for megapixels in options["megapixels"]:
+                content = synthetic_image(megapixels, image_format)
+                for tier_name in options["tiers"]:
+                    key = f"{tier_name}/{image_format}/{megapixels}MP"
+                    self.stderr.write(f"Processing {key}")
+                    results["processing"][key], image = self.__bench_processing(
+                        tier_name, image_format, content, options["repeat"]
+                    )
+                    served_image = served_image or image
+        content = synthetic_image(options["megapixels"][0], options["formats"][0])
+        for concurrency in options["upload_concurrency"]:
+            key = f"{options['formats'][0]}/{options['megapixels'][0]}MP/concurrency_{concurrency}"
+            self.stderr.write(f"Uploading {key}")
+            results["uploads"][key] = self.__bench_uploads(
+                options["formats"][0], content, options["uploads"], concurrency
+            )
+        if served_image is not None:
+            results["serving"] = self.__bench_serving(served_image, options["requests"], options["concurrency"])
+        return results
+
+    def __client_for(self, tier_name: str) -> tuple:
+        tier, _ = Tier.objects.get_or_create(
+            name=tier_name,
+            defaults={
+                "thumbnail_heights": TIERS[tier_name],
+                "presence_of_original_file_link": tier_name != "Basic",
+                "ability_to_fetch_expiring_link": tier_name == "Enterprise",
+            },
+        )
+        user, _ = User.objects.get_or_create(username=f"bench-{tier_name.lower()}", defaults={"tier": tier})
+        client = Client()
+        client.force_login(user)
+        return client, user
+
+    def __bench_processing(self, tier_name: str, image_format: str, content: bytes, repeat: int) -> tuple:
+        client, user = self.__client_for(tier_name)
+        extension = ".jpg" if image_format == "JPEG" else ".png"
+        upload_times, processing_times, memory, encoded = [], [], [], []
+        image = None
+        for _ in range(repeat):
+            data = {"original_image": SimpleUploadedFile(f"bench{extension}", content), "live_time": 300}
+            start = time.perf_counter()
+            response = client.post("/images/", data)
+            upload_times.append(time.perf_counter() - start)
+            if response.status_code != 202:
+                raise RuntimeError(f"Upload failed with {response.status_code}: {response.content[:200]}")
+
+            with PeakMemory() as peak_memory:
+                start = time.perf_counter()
+                job_status = process_thumbnail_job(response.json()["job"])
+                processing_times.append(time.perf_counter() - start)
+            if job_status != ThumbnailJob.Status.DONE:
+                raise RuntimeError(f"Thumbnail job {job_status}")
+            memory.append(peak_memory.delta)
+            image = Image.objects.filter(user=user).latest("pk")
+            encoded.append(sum(image.renditions.values_list("byte_size", flat=True)))
+        return {
+            "input_bytes": len(content),
+            "sizes": TIERS[tier_name],
+            "upload": summarize(upload_times),
+            "processing": summarize(processing_times),
+            "peak_rss_delta_bytes": max(memory),
+            "encoded_bytes": encoded[-1],
+        }, image
+
+    def __bench_uploads(self, image_format: str, content: bytes, uploads: int, concurrency: int) -> dict:
+        """
+        Uploads from `concurrency` threads at once, as several API workers would, to measure write concurrency.
+        """
+        client, _ = self.__client_for("Premium")
+        extension = ".jpg" if image_format == "JPEG" else ".png"
+
+        def upload(_) -> tuple:
+            # Test clients are not thread safe, each upload gets its own with the same session.
+            thread_client = Client()
+            thread_client.cookies = client.cookies
+            data = {"original_image": SimpleUploadedFile(f"bench{extension}", content)}
+            start = time.perf_counter()
+            response = thread_client.post("/images/", data)
+            return time.perf_counter() - start, response.status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            uploaded = list(executor.map(upload, range(uploads)))
+        elapsed = time.perf_counter() - start
+        return {
+            "uploads_per_second": uploads / elapsed,
+            "errors": sum(status_code != 202 for _, status_code in uploaded),
+            **summarize([latency for latency, _ in uploaded]),
+        }
+
+    def __get(self, client: Client, url: str, headers: dict) -> float:
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        response.close()
+        return time.perf_counter() - start
+
+    async def __aget(self, client: AsyncClient, url: str, headers: dict) -> float:
+        start = time.perf_counter()
+        response = await client.get(url, headers=headers)
+        if response.streaming:
+            async for _ in response.streaming_content:
+                pass
+        return time.perf_counter() - start
+
+    def __serve(self, client: Client, url: str, headers: dict, requests: int, concurrency: int) -> dict:
+        """
+        WSGI path: sync views, each request in flight holding a thread, as in a threaded WSGI worker.
+        """
+        start = time.perf_counter()
+        if concurrency == 1:
+            latencies = [self.__get(client, url, headers) for _ in range(requests)]
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                latencies = list(executor.map(lambda _: self.__get(client, url, headers), range(requests)))
+        elapsed = time.perf_counter() - start
+        return {"requests_per_second": requests / elapsed, **summarize(latencies)}
+
+    async def __aserve(self, client: AsyncClient, url: str, headers: dict, requests: int, concurrency: int) -> dict:
+        """
+        ASGI path: async views, every request in flight handled by the event loop of a single thread.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def get():
+            async with semaphore:
+                return await self.__aget(client, url, headers)
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(get() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+        return {"requests_per_second": requests / elapsed, **summarize(latencies)}
+
+    def __bench_serving(self, image: Image, requests: int, concurrency: int) -> dict:
+        """
+        Serves the original and a thumbnail through the sync views (WSGI) and the async views (ASGI, "_asgi" suffix),
+        one request at a time and `concurrency` requests at a time ("_concurrent" suffix).
+        """
+        client = Client()
+        client.force_login(image.user)
+        async_client = AsyncClient()
+        async_client.cookies = client.cookies
+        rendition = image.renditions.order_by("height").first()
+        scenarios = {"original": image.original_image.url}
+        if rendition is not None:
+            scenarios["thumbnail"] = image.original_image.storage.url(rendition.storage_path)
+        results = {}
+        for scenario, url in scenarios.items():
+            etag = client.get(url)["ETag"]
+            for name, headers in ((scenario, {}), (f"{scenario}_not_modified", {"If-None-Match": etag})):
+                for suffix, in_flight in (("", 1), ("_concurrent", concurrency)):
+                    self.stderr.write(f"Serving {name}{suffix}")
+                    results[f"{name}{suffix}"] = self.__serve(client, url, headers, requests, in_flight)
+                    with override_settings(ROOT_URLCONF="image_to_thumbnail_rest_api.async_urls"):
+                        results[f"{name}{suffix}_asgi"] = asyncio.run(
+                            self.__aserve(async_client, url, headers, requests, in_flight)
+                        )
+        return results
+
+    def __compare(self, baseline: dict, results: dict):
+        """
+        Prints the change of p50 latencies against a previous run.
+        """
+        self.stdout.write(f"Comparing with {baseline.get('revision')}:")
+        for section, stage in (
+            ("processing", "upload"),
+            ("processing", "processing"),
+            ("serving", None),
+            ("uploads", None),
+        ):
+            for key, current in results[section].items():
+                previous = baseline.get(section, {}).get(key)
+                if previous is None:
+                    continue
+                before, after = (previous[stage], current[stage]) if stage else (previous, current)
+                change = (after["p50"] - before["p50"]) / before["p50"] * 100
+                label = f"{section} {key} {stage or ''}".strip()
+                self.stdout.write(f"  {label}: {before['p50'] * 1000:.2f}ms -> {after['p50'] * 1000:.2f}ms ({change:+.1f}%)")
@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from images.derivatives import evict_derivatives
+
+
+class Command(BaseCommand):
+    help = "Deletes least recently accessed on-demand renditions once they exceed the derivative cache size."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-bytes", type=int, default=None, help="Cache size (defaults to IMAGES_DERIVATIVE_CACHE_MAX_BYTES).")
+        parser.add_argument("--batch-size", type=int, default=500, help="Maximum number of renditions deleted per batch.")
+        parser.add_argument("--loop", action="store_true", help="Keep running, evicting every --interval seconds.")
+        parser.add_argument("--interval", type=float, default=300.0, help="Seconds to sleep between runs with --loop.")
+
+    def handle(self, *args, **options):
+        max_bytes = options["max_bytes"]
+        if max_bytes is None:
+            max_bytes = settings.IMAGES_DERIVATIVE_CACHE_MAX_BYTES
+        while True:
+            deleted, bytes_freed = evict_derivatives(max_bytes, options["batch_size"])
+            self.stdout.write(f"Evicted {deleted} renditions, freed {bytes_freed} bytes")
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
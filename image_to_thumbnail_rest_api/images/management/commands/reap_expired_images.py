@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from images.tasks import reap_expired_images
+
+
+class Command(BaseCommand):
+    help = "Deletes expired images and their files in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Maximum number of images deleted per batch.")
+        parser.add_argument("--loop", action="store_true", help="Keep running, reaping every --interval seconds.")
+        parser.add_argument("--interval", type=float, default=60.0, help="Seconds to sleep between runs with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            deleted, bytes_freed = 0, 0
+            while True:
+                batch_deleted, batch_bytes_freed = reap_expired_images(options["batch_size"])
+                if not batch_deleted:
+                    break
+                deleted += batch_deleted
+                bytes_freed += batch_bytes_freed
+            self.stdout.write(f"Deleted {deleted} expired images, freed {bytes_freed} bytes")
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,36 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from images.lifecycle import find_orphans, unlink_files
+
+
+class Command(BaseCommand):
+    help = (
+        "Lists the files of the media storage that no image, rendition or blob references, and deletes them with --delete. "
+        "The storage is walked one directory at a time and checked against the database in chunks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--delete", action="store_true", help="Delete the orphaned files instead of only listing them.")
+        parser.add_argument(
+            "--min-age", type=int, default=24 * 60 * 60, help="Seconds since a file was written before it can be an orphan."
+        )
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Files checked against the database per query.")
+
+    def handle(self, *args, **options):
+        orphans, orphan_bytes, batch = 0, 0, []
+        for name, size in find_orphans(default_storage, options["min_age"], options["chunk_size"]):
+            orphans += 1
+            orphan_bytes += size
+            if options["verbosity"] > 1 or not options["delete"]:
+                self.stdout.write(name)
+            if options["delete"]:
+                batch.append(name)
+                if len(batch) >= options["chunk_size"]:
+                    unlink_files(default_storage, batch)
+                    batch = []
+        if options["delete"]:
+            unlink_files(default_storage, batch)
+            self.stdout.write(self.style.SUCCESS(f"Deleted {orphans} orphaned files, freed {orphan_bytes} bytes"))
+        else:
+            self.stdout.write(f"Found {orphans} orphaned files taking up {orphan_bytes} bytes, use --delete to delete them")
@@ -0,0 +1,51 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+
+from images.metrics import REGISTRY, start_http_server
+from images.models import ThumbnailJob
+from images.tasks import claim_jobs, requeue_stale_jobs
+from images.workers import close_connections, init_worker, run_job
+
+
+class Command(BaseCommand):
+    help = "Processes queued thumbnail jobs with a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (defaults to CPU count).")
+        parser.add_argument("--batch-size", type=int, default=20, help="Maximum number of jobs claimed per poll.")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument("--job-timeout", type=int, default=600, help="Seconds after which a processing job is considered stale.")
+        parser.add_argument("--max-attempts", type=int, default=3, help="Attempts before a stale job is marked as failed.")
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty.")
+        parser.add_argument("--metrics-port", type=int, default=None, help="Serve metrics on this port at /metrics.")
+
+    def handle(self, *args, **options):
+        close_connections()
+        if options["metrics_port"]:
+            start_http_server(options["metrics_port"])
+        processed = 0
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=init_worker) as executor:
+            while True:
+                requeue_stale_jobs(options["job_timeout"], options["max_attempts"])
+                job_ids = claim_jobs(options["batch_size"])
+                if not job_ids:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+                close_connections()
+                futures = [executor.submit(run_job, job_id) for job_id in job_ids]
+                wait(futures)
+                for job_id, future in zip(job_ids, futures):
+                    try:
+                        job_status, metrics = future.result()
+                        REGISTRY.merge(metrics)
+                    except Exception as e:
+                        job_status = f"{ThumbnailJob.Status.FAILED} ({e})"
+                    if job_status != ThumbnailJob.Status.DONE:
+                        self.stderr.write(f"Thumbnail job {job_id}: {job_status}")
+                processed += len(futures)
+                self.stdout.write(f"Processed {len(futures)} thumbnail jobs")
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} thumbnail jobs in total"))
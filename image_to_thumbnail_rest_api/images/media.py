@@ -0,0 +1,360 @@
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db.models import QuerySet
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+
+from .derivatives import OUTPUT_FORMATS, allowed_heights, atouch, get_or_create_derivative, touch
+from .hotcache import hot_cache, thumbnail_file
+from .metrics import CACHE_REQUESTS
+from .models import Image, ExpiringImage, Rendition
+from .responses import aserve_cached_file, negotiate_format, serve_cached_file, serve_content
+from .signing import verify_expiring_link
+from .tasks import FORMAT_EXTENSIONS, THUMBNAIL_NAME_RE, rendition_name, variant_formats
+
+from users.models import User
+
+# Resolving a media request goes through the same steps in the sync and async views: the steps are generators
+# yielding each database or storage access they need, run by `resolve` in the calling thread or awaited by `aresolve`.
+# They return what the request resolves to, a dict holding either:
+# - an "error" and its "status",
+# - the "storage" and "name" of the file to serve, with its "etag", "last_modified" time and "max_age",
+# - the "content" of a thumbnail from the hot cache,
+# along with "public" and "vary" (on Accept) flags.
+
+
+class Access:
+    """
+    A blocking access made by the resolution steps, with its async counterpart (run in a worker thread by default).
+    """
+
+    def __init__(self, call, acall=None):
+        self.call = call
+        self.acall = acall or sync_to_async(call, thread_sensitive=False)
+
+
+def first(queryset: QuerySet) -> Access:
+    return Access(queryset.first, queryset.afirst)
+
+
+def fetch(queryset: QuerySet) -> Access:
+    async def afetch():
+        return [instance async for instance in queryset]
+
+    return Access(lambda: list(queryset), afetch)
+
+
+def resolve(steps) -> dict:
+    """
+    Runs the resolution steps, making their accesses in the calling thread.
+    """
+    result = None
+    while True:
+        try:
+            access = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result = access.call()
+
+
+async def aresolve(steps) -> dict:
+    """
+    Runs the resolution steps on the event loop, awaiting their accesses.
+    """
+    result = None
+    while True:
+        try:
+            access = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result = await access.acall()
+
+
+def error(message: str, status_code: int) -> dict:
+    return {"error": message, "status": status_code}
+
+
+def media_storage():
+    return Image._meta.get_field("original_image").storage
+
+
+def variant_paths(user: User, storage_path: str) -> dict:
+    """
+    Returns the storage names of the variants of a thumbnail, by format, in order of preference.
+    """
+    name, extension = os.path.splitext(storage_path)
+    return {
+        image_format: f"{name}{FORMAT_EXTENSIONS[image_format]}"
+        for image_format in variant_formats(getattr(user.tier, "variant_formats", None))
+        if FORMAT_EXTENSIONS[image_format] != extension.lower()
+    }
+
+
+def derivative_params(request: HttpRequest, user: User, params) -> tuple:
+    """
+    Returns the height and format of the requested on-demand rendition, the format being negotiated when not given.
+    Raises KeyError or ValueError on invalid parameters.
+    """
+    height = int(params["h"])
+    image_format = params.get("fmt")
+    if image_format:
+        return height, OUTPUT_FORMATS[image_format.lower()]
+    return height, negotiate_format(request, variant_formats(getattr(user.tier, "variant_formats", None)))
+
+
+def derivative_file(image: Image, rendition: Rendition | None, exact: bool) -> dict:
+    """
+    Returns the file served for an on-demand rendition.
+    Stand-ins served while the rendition is being rendered (the nearest rendition, or the original) are not cached.
+    """
+    max_age = settings.IMAGES_MEDIA_MAX_AGE if exact else 0
+    if rendition is None:
+        return original_file(image, max_age)
+    return rendition_file(rendition, max_age)
+
+
+def original_file(image: Image, max_age: int) -> dict:
+    return {
+        "storage": image.original_image.storage,
+        "name": image.original_image.storage_name,
+        "etag": image.etag or None,
+        "last_modified": image.created_at,
+        "max_age": max_age,
+    }
+
+
+def rendition_file(rendition: Rendition, max_age: int) -> dict:
+    return {
+        "storage": media_storage(),
+        "name": rendition.file_name,
+        "etag": rendition.checksum,
+        "last_modified": rendition.created_at,
+        "max_age": max_age,
+    }
+
+
+def thumbnail_renditions(renditions: dict, storage_path: str, variants: dict) -> dict:
+    """
+    Returns the thumbnail stored under `storage_path` and its variants found among the renditions (by storage name),
+    by format, None for the thumbnail itself. Empty if the thumbnail is not among them.
+    """
+    if storage_path not in renditions:
+        return {}
+    return {
+        None: renditions[storage_path],
+        **{image_format: renditions[path] for image_format, path in variants.items() if path in renditions},
+    }
+
+
+def varies_on_accept(file_name: str, params) -> bool:
+    """
+    Tells whether the encoding of the response depends on the formats the client accepts.
+    """
+    return bool(THUMBNAIL_NAME_RE.match(file_name)) or ("h" in params and "fmt" not in params)
+
+
+def get_renditions(user: User, storage_path: str):
+    """
+    Returns the thumbnail stored under the name and its variants, see `thumbnail_renditions`.
+    """
+    variants = variant_paths(user, storage_path)
+    renditions = yield fetch(
+        Rendition.objects.select_related("blob").filter(storage_path__in=[storage_path, *variants.values()])
+    )
+    return thumbnail_renditions(
+        {rendition.storage_path: rendition for rendition in renditions}, storage_path, variants
+    )
+
+
+def get_original(storage_path: str):
+    image = yield first(Image.objects.select_related("blob").filter(original_image=storage_path))
+    if image is None:
+        return error("Image not found", status.HTTP_404_NOT_FOUND)
+    return original_file(image, settings.IMAGES_MEDIA_MAX_AGE)
+
+
+def get_file(request: HttpRequest, user: User, file_name: str):
+    """
+    Resolves the requested original or thumbnail, the thumbnail variant being negotiated.
+    """
+    storage_path = f"{user.id}/images/{file_name}"
+    if THUMBNAIL_NAME_RE.match(file_name):
+        renditions = yield from get_renditions(user, storage_path)
+        if renditions:
+            formats = [image_format for image_format in renditions if image_format]
+            rendition = renditions[negotiate_format(request, formats)]
+            return rendition_file(rendition, settings.IMAGES_MEDIA_MAX_AGE)
+    return (yield from get_original(storage_path))
+
+
+def get_derivative(request: HttpRequest, user: User, file_name: str, params):
+    """
+    Resolves the requested on-demand rendition.
+    The rendition is generated on first request and then served like any other thumbnail.
+    """
+    try:
+        height, image_format = derivative_params(request, user, params)
+    except (KeyError, ValueError):
+        return error(
+            f"Expected h to be a number and fmt one of: {', '.join(OUTPUT_FORMATS)}", status.HTTP_400_BAD_REQUEST
+        )
+    if height not in allowed_heights(user.tier):
+        return error("This height is not available for your tier", status.HTTP_403_FORBIDDEN)
+    original_name = f"{user.id}/images/{file_name}"
+    storage_path = rendition_name(original_name, height, image_format)
+    rendition = yield first(Rendition.objects.select_related("blob").filter(storage_path=storage_path))
+    if rendition is not None:
+        CACHE_REQUESTS.inc(cache="derivatives", result="hit")
+        yield Access(lambda: touch(rendition), lambda: atouch(rendition))
+        return rendition_file(rendition, settings.IMAGES_MEDIA_MAX_AGE)
+    CACHE_REQUESTS.inc(cache="derivatives", result="miss")
+    image = yield first(Image.objects.select_related("blob", "user__tier").filter(original_image=original_name))
+    if image is None:
+        return error("Image not found", status.HTTP_404_NOT_FOUND)
+    rendition, exact = yield Access(lambda: get_or_create_derivative(image, height, image_format))
+    return derivative_file(image, rendition, exact)
+
+
+def get_cached_thumbnail(request: HttpRequest, user: User, file_name: str):
+    """
+    Resolves the thumbnail from the hot cache, without database or storage access, caching it on a miss.
+    Thumbnails too large to be cached are served from storage.
+    """
+    storage_path = f"{user.id}/images/{file_name}"
+    entry = yield Access(lambda: hot_cache.get(storage_path), lambda: hot_cache.aget(storage_path))
+    image_format = negotiate_format(request, entry["formats"]) if entry else None
+    file = entry["files"].get(image_format) if entry else None
+    if file is None:
+        renditions = yield from get_renditions(user, storage_path)
+        if not renditions:
+            return (yield from get_original(storage_path))
+        formats = [image_format for image_format in renditions if image_format]
+        image_format = negotiate_format(request, formats)
+        rendition = renditions[image_format]
+        file = yield Access(lambda: thumbnail_file(media_storage(), rendition))
+        if file is None:
+            return rendition_file(rendition, settings.IMAGES_MEDIA_MAX_AGE)
+        yield Access(
+            lambda: hot_cache.add(storage_path, formats, image_format, file),
+            lambda: hot_cache.aadd(storage_path, formats, image_format, file),
+        )
+    return {"content": file, "max_age": settings.IMAGES_MEDIA_MAX_AGE}
+
+
+def open_image(request: HttpRequest, user: User, user_pk: int, file_name: str, params):
+    """
+    Resolves a request for an original, a thumbnail or an on-demand rendition. Only the owner can access them.
+    """
+    if user.pk != user_pk:
+        return error("You do not have access to this image", status.HTTP_403_FORBIDDEN)
+    if "h" in params:
+        media = yield from get_derivative(request, user, file_name, params)
+    elif hot_cache.enabled and THUMBNAIL_NAME_RE.match(file_name):
+        media = yield from get_cached_thumbnail(request, user, file_name)
+    else:
+        media = yield from get_file(request, user, file_name)
+    return {**media, "vary": varies_on_accept(file_name, params)}
+
+
+def expiring_image(file_name: str):
+    """
+    Resolves an expiring copy of an image, deleting it once expired.
+    """
+    image = yield first(ExpiringImage.objects.filter(image=f"expiring-images/{file_name}"))
+    if image is None:
+        return error("Image does not exist", status.HTTP_404_NOT_FOUND)
+    if image.has_expired():
+        yield Access(lambda: image.image.delete(save=False))
+        yield Access(image.delete, image.adelete)
+        return error("Image has expired", status.HTTP_404_NOT_FOUND)
+    remaining_time = int((image.expires_at - timezone.now()).total_seconds())
+    return {
+        "storage": image.image.storage,
+        "name": image.image.name,
+        "etag": image.etag,
+        "last_modified": image.created_at,
+        "max_age": min(remaining_time, settings.IMAGES_MEDIA_MAX_AGE),
+        "public": True,
+    }
+
+
+def signed_image(token: str, file_name: str):
+    """
+    Resolves the original image of a signed expiring link. The link is verified without touching the database.
+    """
+    try:
+        image_pk, expires_at = verify_expiring_link(token)
+    except signing.SignatureExpired:
+        return error("Image has expired", status.HTTP_404_NOT_FOUND)
+    except signing.BadSignature:
+        return error("Image does not exist", status.HTTP_404_NOT_FOUND)
+    image = yield first(Image.objects.select_related("blob").filter(pk=image_pk))
+    if image is None or os.path.basename(image.original_image.name) != file_name:
+        return error("Image does not exist", status.HTTP_404_NOT_FOUND)
+    remaining_time = expires_at - int(timezone.now().timestamp())
+    return {**original_file(image, min(remaining_time, settings.IMAGES_MEDIA_MAX_AGE)), "public": True}
+
+
+def _content_response(request: HttpRequest, media: dict) -> HttpResponse:
+    file = media["content"]
+    return serve_content(
+        request,
+        file["content"],
+        file["content_type"],
+        file["etag"],
+        file["last_modified"],
+        media["max_age"],
+        media.get("public", False),
+    )
+
+
+def _patch_vary(response: HttpResponse, media: dict) -> HttpResponse:
+    if media.get("vary"):
+        patch_vary_headers(response, ["Accept"])
+    return response
+
+
+def media_response(request: HttpRequest, media: dict) -> HttpResponse | Response:
+    """
+    Serves what a media request resolved to.
+    """
+    if "error" in media:
+        return Response({"error": media["error"]}, status=media["status"])
+    if "content" in media:
+        return _patch_vary(_content_response(request, media), media)
+    response = serve_cached_file(
+        request,
+        media["storage"],
+        media["name"],
+        media["etag"],
+        media["last_modified"],
+        media["max_age"],
+        media.get("public", False),
+    )
+    return _patch_vary(response, media)
+
+
+async def amedia_response(request: HttpRequest, media: dict) -> HttpResponse:
+    """
+    Asynchronous `media_response`, streaming files without holding a thread.
+    """
+    if "error" in media:
+        return JsonResponse({"error": media["error"]}, status=media["status"])
+    if "content" in media:
+        return _patch_vary(_content_response(request, media), media)
+    response = await aserve_cached_file(
+        request,
+        media["storage"],
+        media["name"],
+        media["etag"],
+        media["last_modified"],
+        media["max_age"],
+        media.get("public", False),
+    )
+    return _patch_vary(response, media)
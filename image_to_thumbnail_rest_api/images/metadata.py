@@ -0,0 +1,108 @@
+import math
+
+from PIL import ExifTags
+from PIL import Image as PILImage
+
+# Size (in pixels) of the copy the dominant color and blurhash are computed from. They are not computed at upload:
+# the thumbnail job computes them from the smallest rendition it has just resized, see `RenditionEngine.render`.
+PLACEHOLDER_SIZE = 32
+# Number of blurhash components, horizontally and vertically. 4x3 gives 28 characters.
+BLURHASH_COMPONENTS = (4, 3)
+BASE83_CHARACTERS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+# EXIF orientations turning the image by a quarter, which swaps its width and height.
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+# sRGB to linear RGB, by 8-bit channel value.
+_LINEAR = [value / 255 / 12.92 if value / 255 <= 0.04045 else ((value / 255 + 0.055) / 1.055) ** 2.4 for value in range(256)]
+
+
+def _base83(value: int, length: int) -> str:
+    return "".join(BASE83_CHARACTERS[value // 83 ** (length - i - 1) % 83] for i in range(length))
+
+
+def _srgb(value: float) -> int:
+    value = min(max(value, 0.0), 1.0)
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(image: PILImage.Image, components: tuple = BLURHASH_COMPONENTS) -> str:
+    """
+    Encodes a small RGB image as a blurhash (https://blurha.sh), a placeholder clients decode into a blurred preview.
+    """
+    x_components, y_components = components
+    width, height = image.size
+    pixels = [(_LINEAR[r], _LINEAR[g], _LINEAR[b]) for r, g, b in image.getdata()]
+    factors = []
+    for j in range(y_components):
+        y_basis = [math.cos(math.pi * j * y / height) for y in range(height)]
+        for i in range(x_components):
+            x_basis = [math.cos(math.pi * i * x / width) for x in range(width)]
+            r = g = b = 0.0
+            for y in range(height):
+                row = pixels[y * width : (y + 1) * width]
+                for x, (pixel_r, pixel_g, pixel_b) in enumerate(row):
+                    basis = x_basis[x] * y_basis[y]
+                    r += basis * pixel_r
+                    g += basis * pixel_g
+                    b += basis * pixel_b
+            scale = (1 if i == j == 0 else 2) / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    encoded = _base83(x_components - 1 + (y_components - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, int(max(abs(value) for factor in ac for value in factor) * 166 - 0.5)))
+        max_value = (quantised_max + 1) / 166
+    else:
+        quantised_max, max_value = 0, 1
+    encoded += _base83(quantised_max, 1)
+    encoded += _base83((_srgb(dc[0]) << 16) + (_srgb(dc[1]) << 8) + _srgb(dc[2]), 4)
+    for factor in ac:
+        r, g, b = (
+            max(0, min(18, int(math.floor(math.copysign(abs(value / max_value) ** 0.5, value) * 9 + 9.5))))
+            for value in factor
+        )
+        encoded += _base83(r * 19 * 19 + g * 19 + b, 2)
+    return encoded
+
+
+def dominant_color(image: PILImage.Image) -> str:
+    """
+    Returns the most common color of a small RGB image, once reduced to a few colors, as #rrggbb.
+    """
+    quantized = image.quantize(colors=4)
+    _, index = max(quantized.getcolors())
+    r, g, b = quantized.getpalette()[index * 3 : index * 3 + 3]
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def image_metadata(file) -> dict:
+    """
+    Returns the fields of `Image` read at upload: dimensions as displayed (EXIF orientation applied),
+    EXIF orientation and size in bytes. Only the header is parsed, pixel data is not decoded,
+    placeholders are computed by the thumbnail job (see `placeholders`). Raises OSError if the header cannot be read.
+    """
+    file.seek(0)
+    try:
+        with PILImage.open(file) as image:
+            # PNG images are decoded to look for EXIF data that is not ahead of their pixel data.
+            exif = image.getexif() if image.format != "PNG" or "exif" in image.info else {}
+            orientation = exif.get(ExifTags.Base.Orientation) or 1
+            width, height = image.size
+    finally:
+        file.seek(0)
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    return {"width": width, "height": height, "orientation": orientation, "byte_size": file.size}
+
+
+def placeholders(image: PILImage.Image) -> dict:
+    """
+    Returns the dominant color and blurhash fields of `Image`, from a decoded image turned upright
+    (the smallest rendition, in the thumbnail job).
+    """
+    small = image.copy()
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    small = small.convert("RGB")
+    return {"dominant_color": dominant_color(small), "blurhash": blurhash(small)}
@@ -0,0 +1,267 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.crypto import constant_time_compare
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Upper bounds (in seconds) of the latency histogram buckets, from a cached 304 to the encoding of a large original.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metric:
+    """
+    Metric of the process, one series per combination of label values.
+    """
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple, **extra) -> str:
+        labels = [*zip(self.labelnames, key), *extra.items()]
+        if not labels:
+            return ""
+        escaped = (
+            (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in labels
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def snapshot(self, reset: bool = False) -> dict:
+        with self._lock:
+            series = {key: self._copy(value) for key, value in self._series.items()}
+            if reset:
+                self._series.clear()
+        return series
+
+    def merge(self, series: dict):
+        with self._lock:
+            for key, value in series.items():
+                self._series[key] = self._add(self._series.get(key), value)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, value in sorted(self.snapshot().items()):
+            lines.extend(self._samples(key, value))
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _copy(self, value: float) -> float:
+        return value
+
+    def _add(self, value: float | None, other: float) -> float:
+        return (value or 0) + other
+
+    def _samples(self, key: tuple, value: float) -> list:
+        return [f"{self.name}{self._labels(key)} {value:g}"]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))] += 1
+            self._series[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the time spent in the block, in seconds, and traces it as a span named after the metric.
+        """
+        with span(self.name, **labels):
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.observe(time.perf_counter() - start, **labels)
+
+    def _copy(self, value: tuple) -> tuple:
+        return list(value[0]), value[1]
+
+    def _add(self, value: tuple | None, other: tuple) -> tuple:
+        if value is None:
+            return list(other[0]), other[1]
+        return [a + b for a, b in zip(value[0], other[0])], value[1] + other[1]
+
+    def _samples(self, key: tuple, value: tuple) -> list:
+        counts, total = value
+        samples, cumulative = [], 0
+        for bound, count in zip((*self.buckets, math.inf), counts):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else f"{bound:g}"
+            samples.append(f"{self.name}_bucket{self._labels(key, le=le)} {cumulative}")
+        samples.append(f"{self.name}_sum{self._labels(key)} {total:g}")
+        samples.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return samples
+
+
+class Registry:
+    """
+    Metrics of the process. Worker processes send theirs to their parent as snapshots, merged into its registry.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self, reset: bool = False) -> dict:
+        return {name: metric.snapshot(reset) for name, metric in self.metrics.items()}
+
+    def merge(self, snapshot: dict):
+        for name, series in snapshot.items():
+            self.metrics[name].merge(series)
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics.values() for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "images_stage_seconds",
+        "Time spent in each stage of the image pipeline.",
+        ("stage", "tier", "height", "format"),
+    )
+)
+IMAGE_BYTES = REGISTRY.register(
+    Counter(
+        "images_bytes_total",
+        "Bytes of uploaded originals (in) and encoded renditions (out).",
+        ("direction", "tier", "format"),
+    )
+)
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram("images_request_seconds", "Time to respond to a request, up to the first byte of the body.", ("view", "method"))
+)
+RESPONSES = REGISTRY.register(
+    Counter("images_responses_total", "Responses by view and status code.", ("view", "method", "status"))
+)
+SERVED_BYTES = REGISTRY.register(
+    Counter("images_served_bytes_total", "Bytes of response bodies with a known length.", ("view",))
+)
+CACHE_REQUESTS = REGISTRY.register(
+    Counter("images_cache_requests_total", "Cache lookups by cache and result (hit or miss).", ("cache", "result"))
+)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Traces the block as an OpenTelemetry span, when OpenTelemetry is installed.
+    """
+    if trace is None:
+        yield None
+        return
+    with trace.get_tracer("images").start_as_current_span(name, attributes=attributes) as current_span:
+        yield current_span
+
+
+def configure_tracing():
+    """
+    Exports spans to the IMAGES_TRACING_EXPORTER: "console", or "otlp" for a local collector
+    (OTEL_EXPORTER_OTLP_ENDPOINT, http://localhost:4318 by default).
+    """
+    exporter_name = settings.IMAGES_TRACING_EXPORTER
+    if not exporter_name:
+        return
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    except ImportError:
+        raise ImproperlyConfigured("Tracing requires opentelemetry-sdk to be installed")
+    if exporter_name == "console":
+        exporter = ConsoleSpanExporter()
+    elif exporter_name == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            raise ImproperlyConfigured("The otlp exporter requires opentelemetry-exporter-otlp-proto-http to be installed")
+        exporter = OTLPSpanExporter()
+    else:
+        raise ImproperlyConfigured(f"Unknown tracing exporter: {exporter_name}")
+    provider = TracerProvider(resource=Resource.create({"service.name": settings.IMAGES_TRACING_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+
+def observe_render(timings: dict, tier: str, image_format: str):
+    """
+    Records the stage timings of a `RenditionEngine.render` result.
+    """
+    for stage in ("open", "decode", "placeholders"):
+        if stage in timings:
+            STAGE_SECONDS.observe(timings[stage], stage=stage, tier=tier, height="", format="")
+    for height, stages in timings.items():
+        if not height.endswith("px"):
+            continue
+        for stage, seconds in stages.items():
+            stage, _, variant_format = stage.partition("_")
+            STAGE_SECONDS.observe(
+                seconds, stage=stage, tier=tier, height=height[:-2], format=variant_format.upper() or image_format
+            )
+
+
+def start_http_server(port: int, address: str = "") -> ThreadingHTTPServer:
+    """
+    Serves the metrics of the process on http://address:port/metrics from a daemon thread,
+    for processes without the API (thumbnail workers). Requires the metrics token when set, like `/metrics`.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            token = settings.IMAGES_METRICS_TOKEN
+            if token and not constant_time_compare(self.headers.get("Authorization", ""), f"Bearer {token}"):
+                self.send_error(403, "Invalid metrics token")
+                return
+            body = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
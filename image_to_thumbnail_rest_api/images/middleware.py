@@ -0,0 +1,45 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpRequest, HttpResponse
+
+from .metrics import REQUEST_SECONDS, RESPONSES, SERVED_BYTES, span
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, status and body size of every response, by view (URL name), and traces the request.
+    Works with sync and async views alike.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __observe(self, request: HttpRequest, response: HttpResponse, start: float):
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - start, view=view, method=request.method)
+        RESPONSES.inc(view=view, method=request.method, status=response.status_code)
+        if response.has_header("Content-Length"):
+            SERVED_BYTES.inc(int(response["Content-Length"]), view=view)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall(request)
+        start = time.perf_counter()
+        with span("http.request", method=request.method, path=request.path):
+            response = self.get_response(request)
+        self.__observe(request, response, start)
+        return response
+
+    async def __acall(self, request: HttpRequest) -> HttpResponse:
+        start = time.perf_counter()
+        with span("http.request", method=request.method, path=request.path):
+            response = await self.get_response(request)
+        self.__observe(request, response, start)
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0002_thumbnailjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thumbnailjob",
+            name="timings",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:04
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def file_checksum(file) -> str:
+    # Copy of images.models.file_checksum as of this migration.
+    checksum = hashlib.sha256()
+    for chunk in file.chunks():
+        checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def compute_etags(apps, schema_editor):
+    for model_name, field_name in (("Image", "original_image"), ("ExpiringImage", "image")):
+        model = apps.get_model("images", model_name)
+        for instance in model.objects.filter(etag="").iterator():
+            file = getattr(instance, field_name)
+            if not file or not file.storage.exists(file.name):
+                continue
+            instance.etag = file_checksum(file)
+            file.close()
+            instance.save(update_fields=["etag"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0003_thumbnailjob_timings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="expiringimage",
+            name="etag",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="etag",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.RunPython(compute_etags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:04
+
+import hashlib
+import os
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+from PIL import Image as PILImage
+
+# Copy of images.tasks.THUMBNAIL_NAME_RE as of this migration.
+THUMBNAIL_NAME_RE = re.compile(r"^(?P<name>.+)_(?P<size>\d+)px_thumbnail(?P<extension>\.\w+)$")
+
+
+def register_existing_thumbnails(apps, schema_editor):
+    """
+    Creates renditions for thumbnails generated before they were stored in the database.
+    Each image directory is listed only once.
+    """
+    Image = apps.get_model("images", "Image")
+    Rendition = apps.get_model("images", "Rendition")
+    thumbnails = {}
+    listed_dir = None
+    for image in Image.objects.order_by("user_id").iterator():
+        if not image.original_image or not os.path.exists(image.original_image.path):
+            continue
+        image_dir = os.path.dirname(image.original_image.path)
+        if image_dir != listed_dir:
+            listed_dir, thumbnails = image_dir, {}
+            for file_name in os.listdir(image_dir):
+                match = THUMBNAIL_NAME_RE.match(file_name)
+                if match:
+                    original_name = f"{match['name']}{match['extension']}"
+                    thumbnails.setdefault(original_name, []).append(file_name)
+        for file_name in thumbnails.get(os.path.basename(image.original_image.name), []):
+            file_path = os.path.join(image_dir, file_name)
+            with open(file_path, "rb") as f:
+                content = f.read()
+            with PILImage.open(file_path) as thumbnail:
+                width, height, image_format = thumbnail.width, thumbnail.height, thumbnail.format
+            Rendition.objects.get_or_create(
+                storage_path=f"{os.path.dirname(image.original_image.name)}/{file_name}",
+                defaults={
+                    "image": image,
+                    "height": height,
+                    "width": width,
+                    "format": image_format,
+                    "byte_size": len(content),
+                    "checksum": hashlib.sha256(content).hexdigest(),
+                },
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0004_etag"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Rendition",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("height", models.PositiveIntegerField()),
+                ("width", models.PositiveIntegerField()),
+                ("format", models.CharField(max_length=16)),
+                ("byte_size", models.PositiveBigIntegerField()),
+                ("storage_path", models.CharField(max_length=255, unique=True)),
+                ("checksum", models.CharField(max_length=64)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "image",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="renditions",
+                        to="images.image",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(register_existing_thumbnails, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+# Copy of images.models.IMAGE_FORMATS as of this migration.
+IMAGE_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG"}
+
+
+def fill_formats(apps, schema_editor):
+    Image = apps.get_model("images", "Image")
+    for image_extension, image_format in IMAGE_FORMATS.items():
+        Image.objects.filter(format="", original_image__iendswith=image_extension).update(
+            format=image_format
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0005_rendition"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="format",
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.RunPython(fill_formats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:07
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_expires_at(apps, schema_editor):
+    ExpiringImage = apps.get_model("images", "ExpiringImage")
+    batch = []
+    for expiring_image in ExpiringImage.objects.filter(expires_at=None).iterator():
+        expiring_image.expires_at = (expiring_image.created_at or timezone.now()) + timedelta(
+            seconds=expiring_image.live_time
+        )
+        batch.append(expiring_image)
+        if len(batch) == 1000:
+            ExpiringImage.objects.bulk_update(batch, ["expires_at"])
+            batch = []
+    ExpiringImage.objects.bulk_update(batch, ["expires_at"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0006_image_format"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="expiringimage",
+            name="expires_at",
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.RunPython(fill_expires_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0007_expiringimage_expires_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rendition",
+            name="last_accessed_at",
+            field=models.DateTimeField(
+                db_index=True, default=django.utils.timezone.now
+            ),
+        ),
+        migrations.AddField(
+            model_name="rendition",
+            name="on_demand",
+            field=models.BooleanField(default=False),
+        ),
+    ]
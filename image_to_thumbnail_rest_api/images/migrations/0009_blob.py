@@ -0,0 +1,104 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+import images.models
+
+
+def register_blobs(apps, schema_editor):
+    """
+    Creates blobs for the files stored before deduplication. Files are not moved, each blob keeps the first file
+    found with its contents; later files with the same contents are no longer read.
+    """
+    Blob = apps.get_model("images", "Blob")
+    Image = apps.get_model("images", "Image")
+    Rendition = apps.get_model("images", "Rendition")
+    storage = Image._meta.get_field("original_image").storage
+    blobs = {}
+
+    def blob_for(checksum, name, byte_size):
+        if checksum not in blobs:
+            blobs[checksum] = Blob.objects.create(
+                checksum=checksum, storage_path=name, byte_size=byte_size
+            )
+        blobs[checksum].ref_count += 1
+        return blobs[checksum]
+
+    images = Image.objects.exclude(original_image="").exclude(etag="")
+    for pk, name, etag in images.values_list("pk", "original_image", "etag").iterator():
+        if etag not in blobs:
+            try:
+                byte_size = storage.size(name)
+            except OSError:
+                continue
+        else:
+            byte_size = 0
+        Image.objects.filter(pk=pk).update(blob=blob_for(etag, name, byte_size))
+    renditions = Rendition.objects.values_list(
+        "pk", "storage_path", "checksum", "byte_size"
+    )
+    for pk, storage_path, checksum, byte_size in renditions.iterator():
+        Rendition.objects.filter(pk=pk).update(
+            blob=blob_for(checksum, storage_path, byte_size)
+        )
+    for blob in blobs.values():
+        Blob.objects.filter(pk=blob.pk).update(ref_count=blob.ref_count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0008_rendition_on_demand"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Blob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("checksum", models.CharField(max_length=64, unique=True)),
+                ("storage_path", models.CharField(max_length=255, unique=True)),
+                ("byte_size", models.PositiveBigIntegerField()),
+                ("ref_count", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="image",
+            name="original_image",
+            field=images.models.BlobImageField(
+                upload_to=images.models.image_upload_location
+            ),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="images",
+                to="images.blob",
+            ),
+        ),
+        migrations.AddField(
+            model_name="rendition",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="renditions",
+                to="images.blob",
+            ),
+        ),
+        migrations.RunPython(register_blobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:37
+
+from django.db import migrations, models
+import images.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0010_thumbnailjob_formats"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="expiringimage",
+            name="image",
+            field=models.ImageField(
+                db_index=True, upload_to=images.models.expiring_image_upload_location
+            ),
+        ),
+        migrations.AlterField(
+            model_name="image",
+            name="original_image",
+            field=images.models.BlobImageField(
+                db_index=True, upload_to=images.models.image_upload_location
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="image",
+            index=models.Index(
+                fields=["user", "-created_at", "-id"], name="image_user_created_idx"
+            ),
+        ),
+    ]
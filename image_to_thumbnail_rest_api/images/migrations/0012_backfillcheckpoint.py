@@ -0,0 +1,32 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0011_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BackfillCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("last_image_id", models.BigIntegerField(default=0)),
+                ("images_scanned", models.PositiveBigIntegerField(default=0)),
+                ("jobs_created", models.PositiveBigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0012_backfillcheckpoint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="blurhash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="byte_size",
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="dominant_color",
+            field=models.CharField(blank=True, max_length=7),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="height",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="orientation",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="width",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,4 +1,47 @@
-from django.db import models
+import hashlib
+import os
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.fields.files import ImageFieldFile
+from django.utils import timezone
+
+from .metrics import CACHE_REQUESTS
+
+IMAGE_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG"}
+
+
+def file_checksum(file) -> str:
+    """
+    Returns the SHA-256 hex digest of the file contents, used as its strong ETag.
+    """
+    checksum = hashlib.sha256()
+    for chunk in file.chunks():
+        checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+# Key of the checksum in the `content_type_extra` of uploaded files.
+# Not a string, so that it cannot be set by the parameters of the part's Content-Type header.
+UPLOAD_CHECKSUM_KEY = ("images", "sha256")
+
+
+def upload_checksum(file) -> str:
+    """
+    Returns the checksum computed by the image upload handler while the file streamed in, or computes it.
+    """
+    content_type_extra = getattr(file, "content_type_extra", None) or {}
+    return content_type_extra.get(UPLOAD_CHECKSUM_KEY) or file_checksum(file)
+
+
+def blob_location(checksum: str, extension: str) -> str:
+    """
+    Location for the file of a blob, derived from its contents.
+    """
+    return f"blobs/{checksum[:2]}/{checksum}{extension}"
 
 
 def image_upload_location(instance, filename, **kwargs):
@@ -17,19 +60,197 @@ def expiring_image_upload_location(instance, filename, **kwargs):
     return file_path
 
 
+class Blob(models.Model):
+    """
+    This model is used to store file contents once, however many images or renditions have the same bytes.
+    A blob is reference counted and deleted, along with its file, when its last reference goes away.
+    """
+
+    checksum = models.CharField(max_length=64, unique=True)
+    storage_path = models.CharField(max_length=255, unique=True)
+    byte_size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.storage_path
+
+    @classmethod
+    def acquire(cls, content, extension: str, checksum: str = None) -> "Blob":
+        """
+        Takes a reference on the blob holding the content, storing the content first if no blob holds it yet.
+        """
+        checksum = checksum or file_checksum(content)
+        if cls.objects.filter(checksum=checksum).update(ref_count=F("ref_count") + 1):
+            CACHE_REQUESTS.inc(cache="blob", result="hit")
+            return cls.objects.get(checksum=checksum)
+        CACHE_REQUESTS.inc(cache="blob", result="miss")
+        # Storages never overwrite, a concurrent write of the same contents ends up under another name.
+        storage_path = default_storage.save(blob_location(checksum, extension), content)
+        try:
+            with transaction.atomic():
+                return cls.objects.create(
+                    checksum=checksum, storage_path=storage_path, byte_size=content.size, ref_count=1
+                )
+        except IntegrityError:
+            default_storage.delete(storage_path)
+            return cls.acquire(content, extension, checksum)
+
+    def release(self):
+        """
+        Drops a reference, deleting the blob and its file with the last one.
+        """
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(pk=self.pk).first()
+            if blob is None:
+                return
+            if blob.ref_count > 1:
+                Blob.objects.filter(pk=self.pk).update(ref_count=F("ref_count") - 1)
+                return
+            blob.delete()
+            transaction.on_commit(lambda: default_storage.delete(blob.storage_path))
+
+    @classmethod
+    def release_many(cls, counts: dict) -> tuple:
+        """
+        Drops `counts[pk]` references of each blob at once, deleting the blobs left without references.
+        Returns the storage paths of the deleted blobs, whose files are left to the caller to delete once committed,
+        and the number of bytes they take up.
+        """
+        if not counts:
+            return [], 0
+        with transaction.atomic():
+            blobs = list(
+                cls.objects.select_for_update()
+                .filter(pk__in=counts)
+                .values_list("pk", "ref_count", "storage_path", "byte_size")
+            )
+            released = defaultdict(list)
+            for pk, ref_count, _, _ in blobs:
+                if ref_count > counts[pk]:
+                    released[counts[pk]].append(pk)
+            for count, pks in released.items():
+                cls.objects.filter(pk__in=pks).update(ref_count=F("ref_count") - count)
+            unreferenced = [blob for blob in blobs if blob[1] <= counts[blob[0]]]
+            cls.objects.filter(pk__in=[pk for pk, _, _, _ in unreferenced]).delete()
+        return [storage_path for _, _, storage_path, _ in unreferenced], sum(size for _, _, _, size in unreferenced)
+
+
+class BlobImageFieldFile(ImageFieldFile):
+    """
+    Image file kept under its own (public) name while its contents are stored in a blob of the instance.
+    Saving stores the contents as a blob, reading goes to the blob's file and deleting releases the blob.
+    Instances without a blob read and delete the file at their name.
+    """
+
+    @property
+    def storage_name(self) -> str:
+        blob = self.instance.blob if self.instance.blob_id else None
+        return blob.storage_path if blob else self.name
+
+    def _get_file(self):
+        self._require_file()
+        if getattr(self, "_file", None) is None:
+            self._file = self.storage.open(self.storage_name, "rb")
+        return self._file
+
+    file = property(_get_file, ImageFieldFile._set_file, ImageFieldFile._del_file)
+
+    @property
+    def path(self) -> str:
+        self._require_file()
+        return self.storage.path(self.storage_name)
+
+    @property
+    def size(self) -> int:
+        self._require_file()
+        if not self._committed:
+            return self.file.size
+        return self.storage.size(self.storage_name)
+
+    def open(self, mode: str = "rb"):
+        self._require_file()
+        if getattr(self, "_file", None) is None:
+            self.file = self.storage.open(self.storage_name, mode)
+        else:
+            self.file.open(mode)
+        return self
+
+    def __available_name(self, name: str, taken: set = None) -> str:
+        """
+        Names are no longer reserved by files on disk, so they are made unique among the instances,
+        and among the `taken` names of instances not saved yet, to which the name is added.
+        """
+        model = type(self.instance)
+        file_root, file_ext = os.path.splitext(name)
+        taken = set() if taken is None else taken
+        while name in taken or model.objects.filter(**{self.field.name: name}).exists():
+            name = self.storage.get_alternative_name(file_root, file_ext)
+        taken.add(name)
+        return name
+
+    def save(self, name: str, content, save: bool = True, taken: set = None):
+        name = self.field.generate_filename(self.instance, name)
+        self.instance.blob = Blob.acquire(content, os.path.splitext(name)[1].lower(), upload_checksum(content))
+        self.name = self.__available_name(name, taken)
+        setattr(self.instance, self.field.attname, self.name)
+        self._committed = True
+        if save:
+            self.instance.save()
+
+    def delete(self, save: bool = True):
+        if not self:
+            return
+        if hasattr(self, "_file"):
+            self.close()
+            del self.file
+        if self.instance.blob_id:
+            self.instance.blob.release()
+            self.instance.blob = None
+        else:
+            self.storage.delete(self.name)
+        self.name = None
+        setattr(self.instance, self.field.attname, self.name)
+        self._committed = False
+        if save:
+            self.instance.save()
+
+
+class BlobImageField(models.ImageField):
+    """
+    Image field storing its files as blobs, see BlobImageFieldFile. The model needs a `blob` foreign key.
+    """
+
+    attr_class = BlobImageFieldFile
+
+
 class ExpiringImage(models.Model):
     """
     This model is used to store images that are only accessible for a limited time, after which they are deleted.
     """
 
     user = models.ForeignKey("users.User", on_delete=models.CASCADE)
-    image = models.ImageField(upload_to=expiring_image_upload_location)
+    image = models.ImageField(upload_to=expiring_image_upload_location, db_index=True)
     live_time = models.IntegerField()
     created_at = models.DateTimeField(auto_now_add=True, null=True)
+    expires_at = models.DateTimeField(null=True, db_index=True)
+    etag = models.CharField(max_length=64, blank=True)
 
     def __str__(self):
         return self.image.url
 
+    def save(self, *args, **kwargs):
+        if self.image and not self.etag:
+            self.etag = file_checksum(self.image)
+        if self.expires_at is None:
+            self.expires_at = (self.created_at or timezone.now()) + timedelta(
+                seconds=int(self.live_time)
+            )
+        super().save(*args, **kwargs)
+
+    def has_expired(self) -> bool:
+        return self.expires_at <= timezone.now()
+
 
 class Image(models.Model):
     """
@@ -37,8 +258,117 @@ class Image(models.Model):
     """
 
     user = models.ForeignKey("users.User", on_delete=models.CASCADE)
-    original_image = models.ImageField(upload_to=image_upload_location)
+    original_image = BlobImageField(upload_to=image_upload_location, db_index=True)
+    blob = models.ForeignKey(Blob, null=True, blank=True, on_delete=models.SET_NULL, related_name="images")
+    format = models.CharField(max_length=16, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    etag = models.CharField(max_length=64, blank=True)
+    # Read from the header at upload (see images/metadata.py), so clients can lay images out before fetching them.
+    # Dimensions are those of the image as displayed, once its EXIF orientation is applied.
+    # Placeholders (dominant color and blurhash) are computed by the thumbnail job, which decodes the image.
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    orientation = models.PositiveSmallIntegerField(null=True, blank=True)
+    byte_size = models.PositiveBigIntegerField(null=True, blank=True)
+    dominant_color = models.CharField(max_length=7, blank=True)
+    blurhash = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        indexes = [
+            # Listing of a user's images, newest first (keyset pagination).
+            models.Index(fields=["user", "-created_at", "-id"], name="image_user_created_idx"),
+        ]
 
     def __str__(self):
         return self.original_image.url
+
+    def commit_original(self, taken: set = None):
+        """
+        Stores a newly assigned original file as a blob, unless one already holds the same contents.
+        `taken` holds the names given to originals of images not saved yet, see BlobImageFieldFile.save.
+        """
+        if self.original_image and not self.original_image._committed:
+            self.original_image.save(self.original_image.name, self.original_image.file, save=False, taken=taken)
+            self.etag = self.blob.checksum
+
+    def save(self, *args, **kwargs):
+        self.commit_original()
+        if self.original_image and not self.etag:
+            self.etag = file_checksum(self.original_image)
+        if self.original_image and not self.format:
+            image_extension = os.path.splitext(self.original_image.name)[1].lower()
+            self.format = IMAGE_FORMATS.get(image_extension, "")
+        super().save(*args, **kwargs)
+
+
+class Rendition(models.Model):
+    """
+    This model is used to store the thumbnails generated from an image.
+    """
+
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name="renditions")
+    height = models.PositiveIntegerField()
+    width = models.PositiveIntegerField()
+    format = models.CharField(max_length=16)
+    byte_size = models.PositiveBigIntegerField()
+    storage_path = models.CharField(max_length=255, unique=True)
+    blob = models.ForeignKey(Blob, null=True, blank=True, on_delete=models.SET_NULL, related_name="renditions")
+    checksum = models.CharField(max_length=64)
+    on_demand = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.storage_path
+
+    @property
+    def file_name(self) -> str:
+        """
+        Storage name of the file holding the rendition, `storage_path` being its public name.
+        """
+        return self.blob.storage_path if self.blob_id else self.storage_path
+
+
+class ThumbnailJob(models.Model):
+    """
+    This model is used to queue thumbnail generation for an uploaded image, so that resizing happens in a worker
+    process instead of the request that uploaded the image.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        PROCESSING = "processing"
+        DONE = "done"
+        FAILED = "failed"
+
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name="thumbnail_jobs")
+    sizes = models.JSONField()
+    # Formats thumbnails are additionally encoded in, IMAGES_VARIANT_FORMATS when not set.
+    formats = models.JSONField(null=True, blank=True)
+    status = models.CharField(
+        max_length=16, choices=Status.choices, default=Status.PENDING, db_index=True
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    timings = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.image} ({self.status})"
+
+
+class BackfillCheckpoint(models.Model):
+    """
+    This model is used to record how far a rendition backfill went, so that it resumes there after being stopped.
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+    last_image_id = models.BigIntegerField(default=0)
+    images_scanned = models.PositiveBigIntegerField(default=0)
+    jobs_created = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} (after image {self.last_image_id})"
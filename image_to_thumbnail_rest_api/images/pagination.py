@@ -0,0 +1,68 @@
+import base64
+import binascii
+
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over (created_at, pk), newest first.
+    Every page is a single indexed range query, no matter how deep the client pages.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = 50
+    max_page_size = 200
+
+    def __encode_cursor(self, instance) -> str:
+        position = f"{instance.created_at.isoformat()}|{instance.pk}"
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def __decode_cursor(self, cursor: str) -> tuple:
+        try:
+            created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound("Invalid cursor")
+        if created_at is None:
+            raise NotFound("Invalid cursor")
+        return created_at, pk
+
+    def __get_page_size(self, request: Request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset: QuerySet, request: Request, view=None) -> list:
+        self.request = request
+        page_size = self.__get_page_size(request)
+        queryset = queryset.order_by("-created_at", "-pk")
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            created_at, pk = self.__decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+            )
+        page = list(queryset[: page_size + 1])
+        self.has_next = len(page) > page_size
+        self.page = page[:page_size]
+        return self.page
+
+    def get_next_link(self) -> str | None:
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.__encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data) -> Response:
+        return Response({"next": self.get_next_link(), "results": data})
@@ -0,0 +1,125 @@
+import io
+import time
+
+from PIL import ExifTags, ImageOps
+from PIL import Image as PILImage
+
+from .metadata import placeholders as image_placeholders
+
+try:
+    # Registers the AVIF plugin on Pillow builds without native AVIF support.
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+
+def supported_formats() -> set:
+    """
+    Returns the formats the installed Pillow build can encode.
+    """
+    PILImage.init()
+    return set(PILImage.SAVE)
+
+
+class RenditionEngine:
+    """
+    Renders a whole set of thumbnail heights from a single decode of the original image.
+    Heights are rendered largest to smallest, each one scaled down from the previous (closest larger) rendition.
+    Images are turned upright according to their EXIF orientation, renditions carry no EXIF data.
+    """
+
+    # Resampling filter used for every downscale step.
+    resample = PILImage.Resampling.LANCZOS
+    # Steps reducing the image by more than this factor first use a cheap integer box reduction.
+    reducing_gap = 2.0
+    # JPEG originals are decoded at reduced scale when they are at least this many times taller than the largest target.
+    draft_threshold = 2
+    # Encoder settings, tuned for small thumbnails.
+    encode_options = {
+        "JPEG": {"quality": 82, "optimize": True, "progressive": True},
+        "PNG": {"optimize": True},
+        "WEBP": {"quality": 80, "method": 4},
+        "AVIF": {"quality": 60, "speed": 6},
+    }
+
+    def __target_size(self, width: int, height: int, target_height: int) -> tuple:
+        """
+        Returns the size of a rendition of given height, keeping the aspect ratio and never upscaling.
+        """
+        if target_height >= height:
+            return width, height
+        return max(1, round(width * target_height / height)), target_height
+
+    def __encode(self, image: PILImage, image_format: str) -> bytes:
+        if image_format == "JPEG" and image.mode not in ("RGB", "L", "CMYK"):
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, **self.encode_options.get(image_format, {}))
+        return buffer.getvalue()
+
+    def render(
+        self, source, heights: list, image_format: str = None, variant_formats: list = (), placeholders: bool = False
+    ) -> dict:
+        """
+        Renders given heights of the source (file path or file object), in the format of the source unless given.
+        Every height is additionally encoded in each of `variant_formats`, from the same resized image.
+        Returns encoded renditions keyed by height, variants keyed by format and height,
+        along with per-stage timings in seconds. With `placeholders`, the placeholder fields of the image
+        (see images/metadata.py) are computed from the smallest rendition too. Nothing is decoded without heights.
+        """
+        timings = {}
+        renditions = {}
+        variants = {variant_format: {} for variant_format in variant_formats}
+        if not heights:
+            return {"renditions": renditions, "variants": variants, "timings": {"total": 0.0}}
+        start = time.perf_counter()
+        with PILImage.open(source) as image:
+            image_format = image_format or image.format
+            timings["open"] = time.perf_counter() - start
+
+            stage = time.perf_counter()
+            largest = max(heights)
+            orientation = image.getexif().get(ExifTags.Base.Orientation) or 1
+            # Heights are those of the image as displayed, once rotated according to its EXIF orientation.
+            transposed = orientation in (5, 6, 7, 8)
+            width, height = (image.height, image.width) if transposed else image.size
+            if image.format == "JPEG" and height >= largest * self.draft_threshold:
+                draft_size = self.__target_size(width, height, largest)
+                image.draft(image.mode, draft_size[::-1] if transposed else draft_size)
+            image.load()
+            current = ImageOps.exif_transpose(image) if orientation != 1 else image
+            timings["decode"] = time.perf_counter() - stage
+            timings["decoded_size"] = current.size
+
+            for height in sorted(set(heights), reverse=True):
+                stage = time.perf_counter()
+                size = self.__target_size(current.width, current.height, height)
+                if size != current.size:
+                    current = current.resize(size, self.resample, reducing_gap=self.reducing_gap)
+                resized = time.perf_counter()
+                content = self.__encode(current, image_format)
+                renditions[height] = {
+                    "content": content,
+                    "width": current.width,
+                    "height": current.height,
+                    "format": image_format,
+                }
+                timings[f"{height}px"] = {
+                    "resize": resized - stage,
+                    "encode": time.perf_counter() - resized,
+                }
+                for variant_format in variants:
+                    encoded = time.perf_counter()
+                    variants[variant_format][height] = {
+                        **renditions[height],
+                        "content": self.__encode(current, variant_format),
+                        "format": variant_format,
+                    }
+                    timings[f"{height}px"][f"encode_{variant_format.lower()}"] = time.perf_counter() - encoded
+            result = {"renditions": renditions, "variants": variants, "timings": timings}
+            if placeholders:
+                stage = time.perf_counter()
+                result["placeholders"] = image_placeholders(current)
+                timings["placeholders"] = time.perf_counter() - stage
+        timings["total"] = time.perf_counter() - start
+        return result
@@ -0,0 +1,282 @@
+import mimetypes
+import re
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import Storage
+from django.http import FileResponse, HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+
+# Not known to the mimetypes module of older Python versions.
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+
+
+def content_type_for(name: str) -> str:
+    """
+    Returns the MIME type of the file, based on its extension.
+    """
+    content_type, _ = mimetypes.guess_type(name)
+    return content_type or "application/octet-stream"
+
+
+def negotiate_format(request: Request, image_formats: list) -> str | None:
+    """
+    Returns the first of the given image formats explicitly accepted by the client, if any.
+    Wildcards are not taken into account: browsers send `*/*` without supporting every image format.
+    """
+    accepted = set()
+    for media_range in request.headers.get("Accept", "").split(","):
+        media_type, *params = (part.strip() for part in media_range.split(";"))
+        quality = next((param.split("=", 1)[1] for param in params if param.startswith("q=")), "1")
+        try:
+            if float(quality) > 0:
+                accepted.add(media_type.lower())
+        except ValueError:
+            continue
+    for image_format in image_formats:
+        if f"image/{image_format.lower()}" in accepted:
+            return image_format
+    return None
+
+
+def parse_range(range_header: str, size: int) -> tuple | None:
+    """
+    Parses a single `bytes=` range, returns inclusive (start, end) offsets.
+    Returns None when the header should be ignored, raises ValueError when the range is not satisfiable.
+    """
+    match = RANGE_RE.match(range_header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start > end:
+            raise ValueError("Range not satisfiable")
+    else:
+        suffix_length = int(last)
+        if suffix_length == 0:
+            raise ValueError("Range not satisfiable")
+        start = max(size - suffix_length, 0)
+        end = size - 1
+    return start, end
+
+
+def _read_range(file, start: int, length: int):
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+async def _aread_range(storage: Storage, name: str, start: int, length: int):
+    """
+    Reads the file chunk by chunk, each blocking read in a worker thread, so the event loop only waits
+    on the client while a chunk is being sent.
+    """
+    file = await sync_to_async(storage.open, thread_sensitive=False)(name, "rb")
+    try:
+        if start:
+            await sync_to_async(file.seek, thread_sensitive=False)(start)
+        while length > 0:
+            chunk = await sync_to_async(file.read, thread_sensitive=False)(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        await sync_to_async(file.close, thread_sensitive=False)()
+
+
+def _sendfile_response(storage: Storage, name: str, content_type: str) -> HttpResponse | None:
+    """
+    Leaves the transfer of the file to the front proxy.
+    Returns None if the storage has no local path to give to X-Sendfile.
+    """
+    response = HttpResponse(content_type=content_type)
+    if settings.IMAGES_SENDFILE_BACKEND == "x-accel-redirect":
+        response["X-Accel-Redirect"] = f"{settings.IMAGES_SENDFILE_URL_PREFIX.rstrip('/')}/{name}"
+        return response
+    try:
+        response["X-Sendfile"] = storage.path(name)
+    except NotImplementedError:
+        return None
+    return response
+
+
+def _requested_range(request: HttpRequest, size: int) -> tuple | HttpResponse:
+    """
+    Returns the inclusive (start, end) offsets of the bytes to send and whether they are only a part of the file,
+    or the 416 response to an unsatisfiable range.
+    """
+    try:
+        byte_range = parse_range(request.headers.get("Range", ""), size)
+    except ValueError:
+        response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+    if byte_range is None:
+        return 0, size - 1, False
+    return *byte_range, True
+
+
+def _ranged_response(response_class, content, size: int, byte_range: tuple, content_type: str) -> HttpResponse:
+    """
+    Wraps the requested bytes of the file in a response of the class, 206 for a part of the file.
+    """
+    start, end, partial = byte_range
+    response = response_class(
+        content,
+        status=status.HTTP_206_PARTIAL_CONTENT if partial else status.HTTP_200_OK,
+        content_type=content_type,
+    )
+    response["Content-Length"] = str(end - start + 1)
+    if partial:
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def serve_file(request: Request, storage: Storage, name: str) -> HttpResponse | Response:
+    """
+    Streams the file from storage, honouring single byte range requests.
+    """
+    if not name or not storage.exists(name):
+        return Response({"error": "Image not found"}, status=status.HTTP_404_NOT_FOUND)
+    content_type = content_type_for(name)
+    if settings.IMAGES_SENDFILE_BACKEND:
+        response = _sendfile_response(storage, name, content_type)
+        if response is not None:
+            return response
+
+    size = storage.size(name)
+    byte_range = _requested_range(request, size)
+    if isinstance(byte_range, HttpResponse):
+        return byte_range
+    start, end, partial = byte_range
+    if not partial:
+        return _ranged_response(FileResponse, storage.open(name, "rb"), size, byte_range, content_type)
+    content = _read_range(storage.open(name, "rb"), start, end - start + 1)
+    return _ranged_response(StreamingHttpResponse, content, size, byte_range, content_type)
+
+
+def _validators(etag: str | None, last_modified_timestamp: int | None) -> dict:
+    return {"etag": f'"{etag}"' if etag else None, "last_modified": last_modified_timestamp}
+
+
+def _patch_cache_headers(response: HttpResponse, validators: dict, max_age: int, public: bool) -> HttpResponse:
+    """
+    Adds the validators and cache headers to a successful or 304 response, errors are left untouched.
+    """
+    if response.status_code >= 400:
+        return response
+    if validators["etag"]:
+        response["ETag"] = validators["etag"]
+    if validators["last_modified"] is not None:
+        response["Last-Modified"] = http_date(validators["last_modified"])
+    cache_control = {"max_age": max(max_age, 0), "public" if public else "private": True}
+    if max_age >= settings.IMAGES_MEDIA_MAX_AGE:
+        cache_control["immutable"] = True
+    patch_cache_control(response, **cache_control)
+    return response
+
+
+def serve_cached_file(
+    request: Request,
+    storage: Storage,
+    name: str,
+    etag: str | None,
+    last_modified: datetime | None,
+    max_age: int,
+    public: bool = False,
+) -> HttpResponse | Response:
+    """
+    Serves the file with validators and cache headers.
+    Conditional requests matching the validators get a 304 without the file being touched.
+    """
+    validators = _validators(etag, int(last_modified.timestamp()) if last_modified else None)
+    response = get_conditional_response(request, **validators)
+    if response is None:
+        response = serve_file(request, storage, name)
+    return _patch_cache_headers(response, validators, max_age, public)
+
+
+def serve_content(
+    request: HttpRequest,
+    content: bytes,
+    content_type: str,
+    etag: str | None,
+    last_modified_timestamp: int | None,
+    max_age: int,
+    public: bool = False,
+) -> HttpResponse:
+    """
+    Serves file contents held in memory like `serve_cached_file` serves a file from storage.
+    """
+    validators = _validators(etag, last_modified_timestamp)
+    response = get_conditional_response(request, **validators)
+    if response is None:
+        size = len(content)
+        byte_range = _requested_range(request, size)
+        if isinstance(byte_range, HttpResponse):
+            return byte_range
+        start, end, _ = byte_range
+        response = _ranged_response(HttpResponse, content[start : end + 1], size, byte_range, content_type)
+    return _patch_cache_headers(response, validators, max_age, public)
+
+
+async def aserve_file(request: HttpRequest, storage: Storage, name: str) -> HttpResponse:
+    """
+    Asynchronous `serve_file`, for views running on the event loop of an ASGI server.
+    Storage calls run in worker threads and the file is streamed by an async iterator,
+    so a slow client holds no thread while it downloads.
+    """
+    if not name or not await sync_to_async(storage.exists, thread_sensitive=False)(name):
+        return JsonResponse({"error": "Image not found"}, status=status.HTTP_404_NOT_FOUND)
+    content_type = content_type_for(name)
+    if settings.IMAGES_SENDFILE_BACKEND:
+        response = _sendfile_response(storage, name, content_type)
+        if response is not None:
+            return response
+
+    size = await sync_to_async(storage.size, thread_sensitive=False)(name)
+    byte_range = _requested_range(request, size)
+    if isinstance(byte_range, HttpResponse):
+        return byte_range
+    start, end, _ = byte_range
+    content = _aread_range(storage, name, start, end - start + 1)
+    return _ranged_response(StreamingHttpResponse, content, size, byte_range, content_type)
+
+
+async def aserve_cached_file(
+    request: HttpRequest,
+    storage: Storage,
+    name: str,
+    etag: str | None,
+    last_modified: datetime | None,
+    max_age: int,
+    public: bool = False,
+) -> HttpResponse:
+    """
+    Asynchronous `serve_cached_file`.
+    """
+    validators = _validators(etag, int(last_modified.timestamp()) if last_modified else None)
+    response = get_conditional_response(request, **validators)
+    if response is None:
+        response = await aserve_file(request, storage, name)
+    return _patch_cache_headers(response, validators, max_age, public)
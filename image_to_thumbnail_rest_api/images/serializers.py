@@ -1,9 +1,45 @@
 from rest_framework import serializers
 
-from .models import Image
+from .models import Image, Rendition
+
+
+class RenditionSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Rendition
+        fields = ("url", "height", "width", "format", "byte_size")
+
+    def get_url(self, rendition: Rendition) -> str:
+        return rendition.image.original_image.storage.url(rendition.storage_path)
 
 
 class ImageSerializer(serializers.ModelSerializer):
+    renditions = RenditionSerializer(many=True, read_only=True)
+
     class Meta:
         model = Image
-        fields = ("pk", "original_image", "created_at")
+        fields = (
+            "pk",
+            "original_image",
+            "format",
+            "width",
+            "height",
+            "orientation",
+            "byte_size",
+            "dominant_color",
+            "blurhash",
+            "created_at",
+            "renditions",
+        )
+        read_only_fields = ("format", "width", "height", "orientation", "byte_size", "dominant_color", "blurhash")
+
+    def __init__(self, *args, **kwargs):
+        """
+        Accepts an optional `fields` argument, limiting the serialized fields to the given ones.
+        """
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
@@ -0,0 +1,51 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .hotcache import hot_cache
+from .lifecycle import defer_release, defer_usage
+from .models import Blob, Image, Rendition
+
+from users.quotas import release_storage
+
+
+@receiver(post_delete, sender=Image)
+def release_original(sender, instance: Image, **kwargs):
+    """
+    Releases the blob of a deleted image, its file is deleted along with the last image or rendition using it.
+    """
+    if instance.blob_id and not defer_release(instance.blob_id):
+        Blob(pk=instance.blob_id).release()
+
+
+@receiver(post_delete, sender=Image)
+def release_usage(sender, instance: Image, **kwargs):
+    """
+    Takes the deleted image off its owner's storage usage.
+    """
+    if not defer_usage(instance.user_id, instance.byte_size or 0):
+        release_storage(instance.user_id, instance.byte_size or 0)
+
+
+@receiver(post_delete, sender=Rendition)
+def release_rendition(sender, instance: Rendition, **kwargs):
+    """
+    Releases the blob of a deleted rendition, or deletes its file if it has none.
+    """
+    if defer_release(instance.blob_id, instance.storage_path, instance.byte_size):
+        return
+    if instance.blob_id:
+        Blob(pk=instance.blob_id).release()
+    else:
+        Image._meta.get_field("original_image").storage.delete(instance.storage_path)
+
+
+@receiver(post_save, sender=Rendition)
+@receiver(post_delete, sender=Rendition)
+def invalidate_hot_thumbnail(sender, instance: Rendition, **kwargs):
+    """
+    Drops the regenerated or deleted thumbnail from the hot cache, once the change is committed
+    so that a concurrent request cannot cache it again from the previous rows.
+    """
+    transaction.on_commit(lambda: hot_cache.invalidate(instance.storage_path))
+
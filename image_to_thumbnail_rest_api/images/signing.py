@@ -0,0 +1,34 @@
+import time
+
+from django.core import signing
+from django.urls import reverse
+
+from .models import Image
+
+SALT = "images.expiring-link"
+
+
+def expiring_link(image: Image, live_time: int) -> tuple:
+    """
+    Returns a signed url giving access to the original image for `live_time` seconds, along with its expiry timestamp.
+    Nothing is stored, any number of links can be minted for the same image.
+    """
+    expires_at = int(time.time()) + int(live_time)
+    token = signing.Signer(salt=SALT).sign(f"{image.pk}-{expires_at}")
+    file_name = image.original_image.name.rsplit("/", 1)[-1]
+    return reverse("signed-image-view", args=[token, file_name]), expires_at
+
+
+def verify_expiring_link(token: str) -> tuple:
+    """
+    Checks the signature and expiry of a link token, returns the image pk and expiry timestamp.
+    Raises signing.BadSignature for tampered tokens and signing.SignatureExpired for expired ones.
+    """
+    try:
+        image_pk, expires_at = signing.Signer(salt=SALT).unsign(token).split("-")
+        image_pk, expires_at = int(image_pk), int(expires_at)
+    except ValueError:
+        raise signing.BadSignature("Malformed token")
+    if expires_at <= time.time():
+        raise signing.SignatureExpired("Link has expired")
+    return image_pk, expires_at
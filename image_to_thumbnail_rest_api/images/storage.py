@@ -0,0 +1,189 @@
+import io
+import mimetypes
+import os
+import threading
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+from django.utils.encoding import filepath_to_uri
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+# One client (and connection pool) per process, shared by its threads. Keyed by pid so forked workers get their own.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class S3File(File):
+    """
+    Read-only file streaming an S3 object.
+    Reads are served by ranged GET requests from the current position, so seeking never downloads skipped bytes.
+    """
+
+    def __init__(self, storage, name: str):
+        self._storage = storage
+        self.name = name
+        self.mode = "rb"
+        self._position = 0
+        self._body = None
+        self._size = None
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            self._size = self._storage.size(self.name)
+        return self._size
+
+    @property
+    def closed(self) -> bool:
+        return self._body is None
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset != self._position:
+            self.close()
+            self._position = offset
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        if self._body is None:
+            if self._size is not None and self._position >= self._size:
+                return b""
+            try:
+                response = self._storage.client.get_object(
+                    Bucket=self._storage.bucket_name,
+                    Key=self._storage.key(self.name),
+                    Range=f"bytes={self._position}-",
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] == "InvalidRange":
+                    return b""
+                raise
+            self._body = response["Body"]
+        data = self._body.read(size if size is not None and size >= 0 else None)
+        self._position += len(data)
+        return data
+
+    def chunks(self, chunk_size: int = None):
+        self.seek(0)
+        while data := self.read(chunk_size or self.DEFAULT_CHUNK_SIZE):
+            yield data
+
+    def open(self, mode: str = None):
+        self.seek(0)
+        return self
+
+    def close(self):
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+
+@deconstructible
+class S3Storage(Storage):
+    """
+    Storage backed by an S3-compatible object store (AWS S3, MinIO, ...).
+    Connections are pooled by a client shared within the process, large files are uploaded in multiple parts.
+    """
+
+    def __init__(self, bucket_name: str = None, endpoint_url: str = None, location: str = None):
+        if boto3 is None:
+            raise ImproperlyConfigured("The S3 storage backend requires boto3 to be installed")
+        self.bucket_name = bucket_name or settings.IMAGES_S3_BUCKET
+        self.endpoint_url = endpoint_url or settings.IMAGES_S3_ENDPOINT_URL
+        self.location = (location if location is not None else settings.IMAGES_S3_LOCATION).strip("/")
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.IMAGES_S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=settings.IMAGES_S3_MULTIPART_CHUNKSIZE,
+        )
+
+    @property
+    def client(self):
+        key = (os.getpid(), self.endpoint_url)
+        if key not in _clients:
+            with _clients_lock:
+                if key not in _clients:
+                    _clients[key] = boto3.session.Session().client(
+                        "s3",
+                        endpoint_url=self.endpoint_url,
+                        region_name=settings.IMAGES_S3_REGION,
+                        aws_access_key_id=settings.IMAGES_S3_ACCESS_KEY,
+                        aws_secret_access_key=settings.IMAGES_S3_SECRET_KEY,
+                        config=Config(max_pool_connections=settings.IMAGES_S3_MAX_POOL_CONNECTIONS),
+                    )
+        return _clients[key]
+
+    def key(self, name: str) -> str:
+        name = name.replace("\\", "/").lstrip("/")
+        return f"{self.location}/{name}" if self.location else name
+
+    def _open(self, name: str, mode: str = "rb") -> S3File:
+        if "w" in mode:
+            raise ValueError("S3 files can only be opened for reading, use save() to write them")
+        return S3File(self, name)
+
+    def _save(self, name: str, content) -> str:
+        if hasattr(content, "seek"):
+            content.seek(0)
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.client.upload_fileobj(
+            content,
+            self.bucket_name,
+            self.key(name),
+            ExtraArgs={"ContentType": content_type},
+            Config=self.transfer_config,
+        )
+        return name
+
+    def delete(self, name: str):
+        self.client.delete_object(Bucket=self.bucket_name, Key=self.key(name))
+
+    def exists(self, name: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket_name, Key=self.key(name))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def size(self, name: str) -> int:
+        return self.client.head_object(Bucket=self.bucket_name, Key=self.key(name))["ContentLength"]
+
+    def get_modified_time(self, name: str):
+        return self.client.head_object(Bucket=self.bucket_name, Key=self.key(name))["LastModified"]
+
+    def listdir(self, path: str) -> tuple:
+        prefix = self.key(path).rstrip("/")
+        prefix = f"{prefix}/" if prefix else ""
+        directories, files = [], []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, Delimiter="/"):
+            directories.extend(p["Prefix"][len(prefix):].rstrip("/") for p in page.get("CommonPrefixes", []))
+            files.extend(o["Key"][len(prefix):] for o in page.get("Contents", []))
+        return directories, files
+
+    def url(self, name: str) -> str:
+        """
+        Objects are served through the media views, which check access before reading from the bucket.
+        """
+        return urljoin(settings.MEDIA_URL, filepath_to_uri(name))
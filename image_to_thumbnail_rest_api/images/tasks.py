@@ -0,0 +1,269 @@
+import hashlib
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .hotcache import hot_cache
+from .metrics import CACHE_REQUESTS, IMAGE_BYTES, STAGE_SECONDS, observe_render, span
+from .models import IMAGE_FORMATS, Blob, ExpiringImage, Image, Rendition, ThumbnailJob
+from .renditions import RenditionEngine, supported_formats
+
+THUMBNAIL_NAME_RE = re.compile(r"^(?P<name>.+)_(?P<size>\d+)px_thumbnail(?P<extension>\.\w+)$")
+
+
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "AVIF": ".avif"}
+
+
+def rendition_name(original_name: str, size: int, image_format: str = None) -> str:
+    """
+    Returns the storage name of the thumbnail of given size, next to the original image.
+    Thumbnails keep the extension of the original, unless they are encoded in another format.
+    """
+    image_name, image_extension = os.path.splitext(original_name)
+    if image_format and image_format != IMAGE_FORMATS.get(image_extension.lower()):
+        image_extension = FORMAT_EXTENSIONS[image_format]
+    return f"{image_name}_{size}px_thumbnail{image_extension}"
+
+
+def thumbnail_name(image_instance: Image, size: int, image_format: str = None) -> str:
+    """
+    Returns the storage name of the thumbnail of given size, relative to the original image.
+    """
+    return rendition_name(image_instance.original_image.name, size, image_format)
+
+
+def variant_formats(formats: list = None) -> list:
+    """
+    Returns the formats thumbnails are additionally encoded in, among the ones supported by Pillow.
+    Defaults to IMAGES_VARIANT_FORMATS unless a tier or job sets its own.
+    """
+    return [
+        variant_format
+        for variant_format in (settings.IMAGES_VARIANT_FORMATS if formats is None else formats)
+        if variant_format in supported_formats()
+    ]
+
+
+def tier_name(image_instance: Image) -> str:
+    """
+    Returns the name of the tier of the image's owner, used to label its metrics.
+    """
+    return getattr(image_instance.user.tier, "name", "")
+
+
+def store_rendition(image_instance: Image, storage_path: str, rendition: dict, on_demand: bool = False) -> Rendition:
+    """
+    Stores the encoded rendition as a blob and records it under `storage_path`, replacing any previous version.
+    """
+    content = ContentFile(rendition["content"])
+    checksum = hashlib.sha256(rendition["content"]).hexdigest()
+    blob = Blob.acquire(content, os.path.splitext(storage_path)[1].lower(), checksum)
+    previous_blob_id = Rendition.objects.filter(storage_path=storage_path).values_list("blob_id", flat=True).first()
+    rendition_instance, _ = Rendition.objects.update_or_create(
+        storage_path=storage_path,
+        defaults={
+            "image": image_instance,
+            "blob": blob,
+            "height": rendition["height"],
+            "width": rendition["width"],
+            "format": rendition["format"],
+            "byte_size": len(rendition["content"]),
+            "checksum": checksum,
+            "on_demand": on_demand,
+            "last_accessed_at": timezone.now(),
+        },
+    )
+    if previous_blob_id:
+        Blob(pk=previous_blob_id).release()
+    return rendition_instance
+
+
+def reuse_renditions(image_instance: Image, keys: list, on_demand: bool = False) -> list:
+    """
+    Records renditions of the image for the (height, format) keys, reusing the blobs of the renditions
+    of another image with the same contents. Nothing is recorded unless every key is available.
+    Returns the new renditions.
+    """
+    if not image_instance.blob_id:
+        return []
+    shared = {}
+    for rendition in (
+        Rendition.objects.filter(image__blob_id=image_instance.blob_id, blob__isnull=False, on_demand=on_demand)
+        .exclude(image=image_instance)
+        .select_related("image")
+        .order_by("pk")
+    ):
+        shared.setdefault((rendition.height, rendition.format), rendition)
+    if not keys or any(key not in shared for key in keys):
+        return []
+    renditions = [
+        Rendition(
+            image=image_instance,
+            blob_id=shared[key].blob_id,
+            storage_path=thumbnail_name(image_instance, key[0], key[1]),
+            height=shared[key].height,
+            width=shared[key].width,
+            format=shared[key].format,
+            byte_size=shared[key].byte_size,
+            checksum=shared[key].checksum,
+            on_demand=on_demand,
+        )
+        for key in keys
+    ]
+    # No thumbnail job decodes the image, its placeholders are those of the image the renditions come from.
+    source = next((shared[key].image for key in keys if shared[key].image.blurhash), None)
+    with transaction.atomic():
+        Rendition.objects.bulk_create(renditions)
+        for rendition in renditions:
+            Blob.objects.filter(pk=rendition.blob_id).update(ref_count=F("ref_count") + 1)
+        if source is not None and not image_instance.blurhash:
+            image_instance.dominant_color, image_instance.blurhash = source.dominant_color, source.blurhash
+            Image.objects.filter(pk=image_instance.pk).update(
+                dominant_color=source.dominant_color, blurhash=source.blurhash
+            )
+    # Bulk creation sends no post_save signal, new variants would not be served from cached thumbnails.
+    for rendition in renditions:
+        hot_cache.invalidate(rendition.storage_path)
+    return renditions
+
+
+def thumbnail_keys(image_instance: Image, sizes: list, formats: list = None) -> list:
+    """
+    Returns the (height, format) of every rendition generated on upload for the image.
+    """
+    return [
+        (size, image_format)
+        for size in sizes
+        for image_format in [image_instance.format, *variant_formats(formats)]
+    ]
+
+
+def enqueue_thumbnails(image_instance: Image, sizes: list, formats: list = None) -> ThumbnailJob:
+    """
+    Queues thumbnail generation of given sizes (and variant formats) for the image.
+    If an image with the same contents already has these thumbnails, they are reused and the job is done at once,
+    as it is without any size.
+    """
+    if not sizes:
+        return ThumbnailJob.objects.create(
+            image=image_instance,
+            sizes=sizes,
+            formats=formats,
+            status=ThumbnailJob.Status.DONE,
+            finished_at=timezone.now(),
+        )
+    if reuse_renditions(image_instance, thumbnail_keys(image_instance, sizes, formats)):
+        CACHE_REQUESTS.inc(cache="renditions", result="hit")
+        return ThumbnailJob.objects.create(
+            image=image_instance,
+            sizes=sizes,
+            formats=formats,
+            status=ThumbnailJob.Status.DONE,
+            finished_at=timezone.now(),
+        )
+    CACHE_REQUESTS.inc(cache="renditions", result="miss")
+    return ThumbnailJob.objects.create(image=image_instance, sizes=sizes, formats=formats)
+
+
+def claim_jobs(limit: int) -> list:
+    """
+    Marks up to `limit` pending jobs as processing and returns their ids.
+    A job is only claimed if its status is still pending at update time, so several workers can poll the same queue.
+    """
+    claimed = []
+    pending = ThumbnailJob.objects.filter(status=ThumbnailJob.Status.PENDING).order_by("pk")
+    for job_id in pending.values_list("pk", flat=True)[:limit]:
+        updated = ThumbnailJob.objects.filter(
+            pk=job_id, status=ThumbnailJob.Status.PENDING
+        ).update(
+            status=ThumbnailJob.Status.PROCESSING,
+            started_at=timezone.now(),
+            attempts=F("attempts") + 1,
+        )
+        if updated:
+            claimed.append(job_id)
+    return claimed
+
+
+def requeue_stale_jobs(timeout: int, max_attempts: int) -> int:
+    """
+    Puts jobs that have been processing for longer than `timeout` seconds (e.g. their worker died) back in the queue.
+    Jobs that already used up their attempts are marked as failed instead.
+    """
+    stale = ThumbnailJob.objects.filter(
+        status=ThumbnailJob.Status.PROCESSING,
+        started_at__lt=timezone.now() - timedelta(seconds=timeout),
+    )
+    stale.filter(attempts__gte=max_attempts).update(
+        status=ThumbnailJob.Status.FAILED,
+        error="Job timed out",
+        finished_at=timezone.now(),
+    )
+    return stale.filter(attempts__lt=max_attempts).update(
+        status=ThumbnailJob.Status.PENDING
+    )
+
+
+def process_thumbnail_job(job_id: int) -> str:
+    """
+    Generates all thumbnails of the job and returns its final status.
+    """
+    job = ThumbnailJob.objects.select_related("image__user__tier").get(pk=job_id)
+    image_instance = job.image
+    tier = tier_name(image_instance)
+    try:
+        with span("thumbnail_job", job=job.pk, tier=tier):
+            with image_instance.original_image.open("rb") as original_image:
+                result = RenditionEngine().render(
+                    original_image,
+                    job.sizes,
+                    variant_formats=variant_formats(job.formats),
+                    placeholders=not image_instance.blurhash,
+                )
+            observe_render(result["timings"], tier, image_instance.format)
+            if "placeholders" in result:
+                Image.objects.filter(pk=image_instance.pk).update(**result["placeholders"])
+            renditions = [(None, result["renditions"]), *result["variants"].items()]
+            for variant_format, variants in renditions:
+                for size, rendition in variants.items():
+                    with STAGE_SECONDS.time(stage="store", tier=tier, height=size, format=rendition["format"]):
+                        store_rendition(image_instance, thumbnail_name(image_instance, size, variant_format), rendition)
+                    IMAGE_BYTES.inc(len(rendition["content"]), direction="out", tier=tier, format=rendition["format"])
+    except Exception as e:
+        job.status = ThumbnailJob.Status.FAILED
+        job.error = str(e)
+    else:
+        job.status = ThumbnailJob.Status.DONE
+        job.error = ""
+        job.timings = result["timings"]
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "error", "timings", "finished_at"])
+    return job.status
+
+
+def reap_expired_images(batch_size: int) -> tuple:
+    """
+    Deletes one batch of expired images, rows and files.
+    Returns the number of deleted images and the number of bytes freed.
+    """
+    expired = list(
+        ExpiringImage.objects.filter(expires_at__lte=timezone.now())
+        .order_by("expires_at")
+        .values_list("pk", "image")[:batch_size]
+    )
+    if not expired:
+        return 0, 0
+    storage = ExpiringImage._meta.get_field("image").storage
+    bytes_freed = 0
+    for _, file_name in expired:
+        if file_name and storage.exists(file_name):
+            bytes_freed += storage.size(file_name)
+            storage.delete(file_name)
+    ExpiringImage.objects.filter(pk__in=[pk for pk, _ in expired]).delete()
+    return len(expired), bytes_freed
@@ -0,0 +1,136 @@
+import hashlib
+import io
+import os
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from PIL import Image as PILImage
+
+from .models import IMAGE_FORMATS, UPLOAD_CHECKSUM_KEY
+
+from users.models import Tier
+
+# Leading bytes of the supported formats.
+MAGIC_NUMBERS = {
+    b"\xff\xd8\xff": "JPEG",
+    b"\x89PNG\r\n\x1a\n": "PNG",
+}
+# Files whose dimensions cannot be read from this many leading bytes are rejected.
+HEADER_MAX_SIZE = 256 * 1024
+
+
+def upload_limits(tier: Tier | None) -> tuple:
+    """
+    Returns the maximum number of bytes and pixels of an image uploaded by a user of the tier.
+    Tiers without limits of their own get the IMAGES_UPLOAD_MAX_* settings.
+    """
+    max_bytes = settings.IMAGES_UPLOAD_MAX_BYTES
+    max_megapixels = settings.IMAGES_UPLOAD_MAX_MEGAPIXELS
+    if tier is not None:
+        max_bytes = tier.max_upload_bytes or max_bytes
+        max_megapixels = tier.max_upload_megapixels or max_megapixels
+    return max_bytes, int(max_megapixels * 1_000_000)
+
+
+def sniff_format(header: bytes) -> str | None:
+    """
+    Returns the format of the image from its magic number, if it is a supported one.
+    """
+    for magic_number, image_format in MAGIC_NUMBERS.items():
+        if header.startswith(magic_number):
+            return image_format
+    return None
+
+
+def inspect_header(file_name: str, header: bytes, max_pixels: int, complete: bool = False) -> tuple:
+    """
+    Checks the leading bytes of an image against its extension and the pixel limit, without decoding it.
+    Returns an error (or None) and whether the check is done; `complete` tells the whole file is in the header.
+    """
+    if len(header) < 8 and not complete:
+        return None, False
+    image_format = sniff_format(header)
+    if image_format is None or image_format != IMAGE_FORMATS.get(os.path.splitext(file_name)[1].lower()):
+        return "Image format not supported", True
+    try:
+        # Opening only parses the header, pixel data is not decoded.
+        with PILImage.open(io.BytesIO(header), formats=[image_format]) as image:
+            width, height = image.size
+    except PILImage.DecompressionBombError:
+        return "Image dimensions are too large", True
+    except OSError:
+        if complete or len(header) >= HEADER_MAX_SIZE:
+            return "Upload a valid image", True
+        return None, False
+    if width * height > max_pixels:
+        return f"Image must be at most {max_pixels / 1_000_000:g} megapixels", True
+    return None, True
+
+
+class ImageUploadHandler(FileUploadHandler):
+    """
+    Validates uploaded images while they stream in, ahead of the handlers writing them to memory or disk.
+    The format is sniffed and the dimensions read from the first chunks, the size is checked on every chunk:
+    a file breaking a rule is skipped at once, before the rest of its body is written anywhere.
+    Errors are collected in `request.upload_errors`, as {"file", "error"} dicts.
+    Files too short to read the dimensions from are left to the regular image validation.
+    The SHA-256 of accepted files is computed on the way and handed over in their `content_type_extra`.
+    Files of `archive_field_names` are only checked against IMAGES_BATCH_MAX_ARCHIVE_BYTES.
+    """
+
+    def __init__(self, request=None, field_names: tuple = ("original_image",), archive_field_names: tuple = ()):
+        super().__init__(request)
+        self.field_names = field_names
+        self.archive_field_names = archive_field_names
+        self.errors = []
+        request.upload_errors = self.errors
+
+    def new_file(self, field_name: str, file_name: str, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.max_bytes, self.max_pixels = upload_limits(getattr(getattr(self.request, "user", None), "tier", None))
+        if field_name in self.archive_field_names:
+            self.max_bytes = settings.IMAGES_BATCH_MAX_ARCHIVE_BYTES
+        self.inspected = field_name not in self.field_names
+        self.header = b""
+        self.received = 0
+        self.checksum = hashlib.sha256()
+
+    def __reject(self, error: str):
+        self.errors.append({"file": self.file_name, "error": error})
+        self.header = b""
+        raise SkipFile()
+
+    def receive_data_chunk(self, raw_data: bytes, start: int) -> bytes:
+        if self.field_name in self.archive_field_names:
+            self.received += len(raw_data)
+            if self.received > self.max_bytes:
+                self.__reject(f"Archive must be at most {self.max_bytes} bytes")
+            return raw_data
+        if self.field_name not in self.field_names:
+            return raw_data
+        self.received += len(raw_data)
+        if self.received > self.max_bytes:
+            self.__reject(f"Image must be at most {self.max_bytes} bytes")
+        if not self.inspected:
+            self.header += raw_data
+            error, self.inspected = inspect_header(self.file_name, self.header, self.max_pixels)
+            if error:
+                self.__reject(error)
+            if self.inspected:
+                self.header = b""
+        self.checksum.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size: int):
+        self.header = b""
+        if self.field_name in self.field_names and self.content_type_extra is not None:
+            # The same dict is given to the handler building the uploaded file.
+            self.content_type_extra[UPLOAD_CHECKSUM_KEY] = self.checksum.hexdigest()
+        return None
+
+
+def install_upload_handler(request, field_names: tuple = ("original_image",), archive_field_names: tuple = ()):
+    """
+    Puts the image upload handler in front of the request's upload handlers. Must run before the body is parsed.
+    """
+    request.upload_handlers.insert(0, ImageUploadHandler(request, field_names, archive_field_names))
@@ -1,7 +1,11 @@
 from django.urls import path
 
-from .views import ImageView
+from .views import BatchImageView, ExpiringLinkView, ImageDetailView, ImageView, ThumbnailJobView
 
 urlpatterns = [
     path("", ImageView.as_view(), name="image-view"),
+    path("<int:pk>/", ImageDetailView.as_view(), name="image-detail-view"),
+    path("batch/", BatchImageView.as_view(), name="batch-image-view"),
+    path("jobs/<int:pk>/", ThumbnailJobView.as_view(), name="thumbnail-job-view"),
+    path("<int:pk>/expiring-links/", ExpiringLinkView.as_view(), name="expiring-link-view"),
 ]
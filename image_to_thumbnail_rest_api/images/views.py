@@ -1,103 +1,343 @@
 import os
-from datetime import datetime
-from typing import Callable
+from datetime import datetime, time
 
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db.models import QuerySet
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.views import View
 from rest_framework import status
 from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_date, parse_datetime
 
-from .image_processor import ImageProcessor
-from .models import Image, ExpiringImage
+from .batch import BatchError, batch_files, upload_batch
+from .image_processor import ImageProcessor, validate_live_time
+from .lifecycle import delete_images
+from .metadata import image_metadata
+from .media import amedia_response, aresolve, expiring_image, media_response, open_image, resolve, signed_image
+from .metrics import CONTENT_TYPE, IMAGE_BYTES, REGISTRY, STAGE_SECONDS
+from .models import IMAGE_FORMATS, Image, ThumbnailJob
+from .pagination import KeysetPagination
 from .serializers import ImageSerializer
-from PIL import Image as PILImage
+from .signing import expiring_link
+from .tasks import thumbnail_name
+from .uploads import install_upload_handler, upload_limits
 
 from users.models import User
+from users.quotas import QuotaExceeded, TierRateThrottle, release_upload, reserve_upload
+from users.tokens import SignedTokenAuthentication, bearer_token, token_user
+
+
+def quota_exceeded(error: QuotaExceeded) -> Response:
+    """
+    Rejects an upload going over a quota: 429 with Retry-After for rate limits, 403 for the storage quota.
+    """
+    if error.retry_after is None:
+        return Response({"error": str(error)}, status=status.HTTP_403_FORBIDDEN)
+    return Response(
+        {"error": str(error), "retry_after": error.retry_after},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(error.retry_after)},
+    )
 
 
 class ImageView(APIView):
-    authentication_classes = [SessionAuthentication]
+    authentication_classes = [SessionAuthentication, SignedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_classes = [TierRateThrottle]
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.image_processor = ImageProcessor()
-        self.options = {
-            "Basic": self.image_processor.basic_tier_processing,
-            "Premium": self.image_processor.premium_tier_processing,
-            "Enterprise": self.image_processor.enterprise_tier_processing,
-        }
+
+    def initialize_request(self, request: HttpRequest, *args, **kwargs) -> Request:
+        if request.method == "POST":
+            install_upload_handler(request)
+        return super().initialize_request(request, *args, **kwargs)
+
+    def __filter_images(self, request: Request, images: QuerySet) -> QuerySet:
+        """
+        Applies the created_after, created_before and image_format query parameters.
+        """
+        for param, lookup in (("created_after", "created_at__gte"), ("created_before", "created_at__lt")):
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            try:
+                created_at = parse_datetime(value) or datetime.combine(parse_date(value), time.min)
+            except (TypeError, ValueError):
+                raise ValidationError({param: "Expected an ISO 8601 date or datetime"})
+            if timezone.is_naive(created_at):
+                created_at = timezone.make_aware(created_at)
+            images = images.filter(**{lookup: created_at})
+        image_format = request.query_params.get("image_format")
+        if image_format:
+            image_format = image_format.upper()
+            images = images.filter(format="JPEG" if image_format == "JPG" else image_format)
+        return images
 
     def get(self, request: Request) -> Response:
         """
-        Lists all images.
+        Lists images, newest first, one page at a time.
         """
-        images = Image.objects.filter(user_id=request.user.id)
-        if images:
-            serializer = ImageSerializer(images, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+        fields = request.query_params.get("fields")
+        fields = fields.split(",") if fields else None
+        images = self.__filter_images(request, Image.objects.filter(user_id=request.user.id))
+        if fields is None or "renditions" in fields:
+            images = images.prefetch_related("renditions")
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(images, request, view=self)
+        if page or request.query_params.get(paginator.cursor_query_param):
+            serializer = ImageSerializer(page, many=True, fields=fields)
+            return paginator.get_paginated_response(serializer.data)
         return Response({"No images found"}, status=status.HTTP_404_NOT_FOUND)
 
-    def post(self, request: Request) -> Response | Callable:
+    def post(self, request: Request) -> Response:
         """
-        Calls the appropriate tier processing method and returns the response.
+        Stores the image, processes it according to the user's tier and returns the response.
+        Thumbnails are generated by the thumbnail worker, the response only carries their (pending) urls.
         """
         user = request.user
+        if user.tier is None:
+            return Response(
+                {"error": "Your account has no tier"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
         image_instance = Image(user=user)
         serializer = ImageSerializer(image_instance, data=request.data)
+        if request.upload_errors:
+            return Response(
+                {"error": request.upload_errors[0]["error"]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
         if serializer.is_valid():
-            serializer.save()
-            image_format = os.path.splitext(image_instance.original_image.url)[1]
-            if image_format not in [".jpg", ".jpeg", ".png"]:
-                image_instance.delete()
+            uploaded_file = serializer.validated_data["original_image"]
+            if os.path.splitext(uploaded_file.name)[1].lower() not in IMAGE_FORMATS:
                 return Response(
                     {"error": "Image format not supported"},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            original_image_path = image_instance.original_image.path
-            with PILImage.open(original_image_path) as image:
-                return self.options.get(user.tier.name, self.image_processor.default_tier_processing)(request, image_instance, image)
+            live_time = None
+            if user.tier.ability_to_fetch_expiring_link:
+                # Checked before anything is stored or counted against the user's quotas.
+                live_time, error_response = validate_live_time(request.data)
+                if error_response:
+                    return error_response
+            image_format = IMAGE_FORMATS[os.path.splitext(uploaded_file.name)[1].lower()]
+            labels = {"tier": user.tier.name, "height": "", "format": image_format}
+            try:
+                with STAGE_SECONDS.time(stage="metadata", **labels):
+                    metadata = image_metadata(uploaded_file)
+            except OSError:
+                return Response(
+                    {"error": "Upload a valid image"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            pixels = metadata["width"] * metadata["height"]
+            try:
+                reserve_upload(user, pixels, metadata["byte_size"])
+            except QuotaExceeded as e:
+                return quota_exceeded(e)
+            try:
+                with STAGE_SECONDS.time(stage="save", **labels):
+                    serializer.save(**metadata)
+            except Exception:
+                release_upload(user.pk, pixels, metadata["byte_size"])
+                raise
+            IMAGE_BYTES.inc(uploaded_file.size, direction="in", tier=user.tier.name, format=image_format)
+            with STAGE_SECONDS.time(stage="enqueue", **labels):
+                return self.image_processor.process(request, image_instance, live_time)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def delete(self, request: Request) -> Response:
+        """
+        Deletes the images listed in `ids`, along with their thumbnails. Ids of other users' images are ignored.
+        """
+        ids = request.data.getlist("ids") if hasattr(request.data, "getlist") else request.data.get("ids")
+        try:
+            # A string would be iterated over character by character.
+            ids = [int(pk) for pk in ids] if isinstance(ids, list) else None
+        except (TypeError, ValueError):
+            ids = None
+        if not ids:
+            return Response(
+                {"error": "Expected ids to be a list of image ids"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(ids) > settings.IMAGES_BULK_DELETE_MAX:
+            return Response(
+                {"error": f"At most {settings.IMAGES_BULK_DELETE_MAX} images can be deleted at once"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        deleted, _ = delete_images(Image.objects.filter(user_id=request.user.id, pk__in=ids))
+        return Response({"deleted": deleted}, status=status.HTTP_200_OK)
+
 
-class ExpiringImageView(APIView):
+class ImageDetailView(APIView):
+    """
+    A single image of the user.
+    """
 
-    def __image_has_expired(self, image: ExpiringImage) -> bool:
+    authentication_classes = [SessionAuthentication, SignedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [TierRateThrottle]
+
+    def delete(self, request: Request, pk: int) -> Response:
         """
-        If image has expired, return true.
+        Deletes the image along with its thumbnails.
         """
-        current_time_in_seconds = int(datetime.now().timestamp())
-        image_creation_time = int(image.created_at.timestamp())
-        if current_time_in_seconds - image_creation_time > int(image.live_time):
-            return True
-        return False
-
-    def __open_image(self, file_path: str) -> HttpResponse | Response:
-        if os.path.exists(file_path):
-            with open(file_path, "rb") as f:
-                image_data = f.read()
-                return HttpResponse(image_data, content_type="image/jpeg")
-        return Response({"error": "Image not found"}, status=status.HTTP_404_NOT_FOUND)
-
-    def get(self, request: Request, file_name: str) -> Response | Callable:
-        try:
-            image = ExpiringImage.objects.get(image=f"expiring-images/{file_name}")
-        except ObjectDoesNotExist:
+        deleted, _ = delete_images(Image.objects.filter(pk=pk, user_id=request.user.id))
+        if not deleted:
             return Response(
                 {"error": "Image does not exist"}, status=status.HTTP_404_NOT_FOUND
             )
-        if self.__image_has_expired(image):
-            image.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class BatchImageView(APIView):
+    """
+    Uploads many images in one request, as several `original_images` files and/or an `archive` (zip or tar).
+    Each file gets its own result, invalid files do not prevent the others from being uploaded.
+    """
+
+    authentication_classes = [SessionAuthentication, SignedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [TierRateThrottle]
+
+    def initialize_request(self, request: HttpRequest, *args, **kwargs) -> Request:
+        if request.method == "POST":
+            install_upload_handler(request, ("original_images",), ("archive",))
+        return super().initialize_request(request, *args, **kwargs)
+
+    def post(self, request: Request) -> Response:
+        if request.user.tier is None:
+            return Response(
+                {"error": "Your account has no tier"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        files = request.FILES.getlist("original_images")
+        archive = request.FILES.get("archive")
+        if not files and archive is None and not request.upload_errors:
             return Response(
-                {"error": "Image has expired"}, status=status.HTTP_404_NOT_FOUND
+                {"error": "No original_images or archive field"},
+                status=status.HTTP_400_BAD_REQUEST,
             )
-        file_path = os.path.join(os.path.dirname(image.image.path), file_name)
-        return self.__open_image(file_path)
+        try:
+            # Files rejected while uploading come first.
+            max_bytes, _ = upload_limits(request.user.tier)
+            results = list(request.upload_errors) + upload_batch(
+                request.user, batch_files(files, archive, max_bytes)
+            )
+        except BatchError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        accepted = sum("error" not in result for result in results)
+        retry_after = [result["retry_after"] for result in results if "retry_after" in result]
+        headers = None
+        if accepted == len(results):
+            response_status = status.HTTP_202_ACCEPTED
+        elif accepted:
+            response_status = status.HTTP_207_MULTI_STATUS
+        elif retry_after:
+            response_status = status.HTTP_429_TOO_MANY_REQUESTS
+            headers = {"Retry-After": str(min(retry_after))}
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({"results": results}, status=response_status, headers=headers)
+
+
+class ThumbnailJobView(APIView):
+    """
+    Thumbnail generation status.
+    Clients poll this endpoint until the thumbnails of an upload are ready.
+    """
+
+    authentication_classes = [SessionAuthentication, SignedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [TierRateThrottle]
 
+    def get(self, request: Request, pk: int) -> Response:
+        try:
+            job = ThumbnailJob.objects.select_related("image").get(
+                pk=pk, image__user_id=request.user.id
+            )
+        except ObjectDoesNotExist:
+            return Response(
+                {"error": "Job does not exist"}, status=status.HTTP_404_NOT_FOUND
+            )
+        storage = job.image.original_image.storage
+        data = {
+            "job": job.pk,
+            "status": job.status,
+            "thumbnails": {
+                f"{size}px_thumbnail": storage.url(thumbnail_name(job.image, size))
+                for size in job.sizes
+            },
+        }
+        if job.status == ThumbnailJob.Status.FAILED:
+            data["error"] = job.error
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class ExpiringImageView(APIView):
+    """
+    Access to expiring copies of images, created before expiring links were signed.
+    """
+
+    def get(self, request: Request, file_name: str) -> HttpResponse | Response:
+        return media_response(request, resolve(expiring_image(file_name)))
+
+
+class SignedImageView(APIView):
+    """
+    Access to original images through signed, time-limited links.
+    The link is verified without touching the database, the image is served from its original file.
+    """
+
+    def get(self, request: Request, token: str, file_name: str) -> HttpResponse | Response:
+        return media_response(request, resolve(signed_image(token, file_name)))
+
+
+class ExpiringLinkView(APIView):
+    """
+    Mints signed expiring links to an image.
+    Only available for tiers with the ability to fetch expiring links.
+    """
+
+    authentication_classes = [SessionAuthentication, SignedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [TierRateThrottle]
+
+    def post(self, request: Request, pk: int) -> Response:
+        user = request.user
+        if user.tier is None or not user.tier.ability_to_fetch_expiring_link:
+            return Response(
+                {"error": "Your tier does not allow expiring links"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        try:
+            image = Image.objects.get(pk=pk, user_id=user.id)
+        except ObjectDoesNotExist:
+            return Response(
+                {"error": "Image does not exist"}, status=status.HTTP_404_NOT_FOUND
+            )
+        live_time, error_response = validate_live_time(request.data)
+        if error_response:
+            return error_response
+        url, expires_at = expiring_link(image, live_time)
+        data = {
+            f"{live_time}s_expiring_link": url,
+            "expires_at": datetime.fromtimestamp(expires_at, tz=timezone.get_current_timezone()),
+        }
+        return Response(data, status=status.HTTP_201_CREATED)
 
 
 class OpenImageView(APIView):
@@ -106,49 +346,82 @@ class OpenImageView(APIView):
     Only the owner of the image can access the image, if it exists.
     """
 
-    authentication_classes = [SessionAuthentication]
+    authentication_classes = [SessionAuthentication, SignedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
-    def __authorize_user(self, request: Request, user_pk: str) -> User | bool:
-        user = request.user
-        if user.pk == user_pk:
-            return user
-        return False
+    def get(self, request: Request, user_pk: int, file_name: str) -> HttpResponse | Response:
+        media = resolve(open_image(request, request.user, user_pk, file_name, request.query_params))
+        return media_response(request, media)
 
-    def __get_file_path(self, request: Request, file_name: str) -> str:
-        user = request.user
-        try:
-            image = Image.objects.get(original_image=f"{user.id}/images/{file_name}")
-            file_path = os.path.join(
-                os.path.dirname(image.original_image.path), file_name
-            )
-        except ObjectDoesNotExist:
-            file_path = self.__find_other_matching_file(request, file_name)
-        return file_path
 
-    def __find_other_matching_file(self, request: Request, file_name: str) -> str:
-        user = request.user
-        images_dir = os.listdir(os.path.join(f"{os.getcwd()}/media/{user.id}/images/"))
-        file_path = ""
-        for img_file in images_dir:
-            if img_file == file_name:
-                file_path = os.path.join(
-                    f"{os.getcwd()}/media/{user.id}/images/{img_file}"
+class MetricsView(View):
+    """
+    Metrics of the process, in the Prometheus text format.
+    Requires `Authorization: Bearer <IMAGES_METRICS_TOKEN>` when the token is set, a staff session otherwise,
+    unless `IMAGES_METRICS_PUBLIC` is set.
+    """
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        token = settings.IMAGES_METRICS_TOKEN
+        if token:
+            if not constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}"):
+                return JsonResponse(
+                    {"error": "Invalid metrics token"}, status=status.HTTP_403_FORBIDDEN
                 )
-        return file_path
+        elif not settings.IMAGES_METRICS_PUBLIC and not request.user.is_staff:
+            return JsonResponse(
+                {"error": "Metrics are only available to staff users"}, status=status.HTTP_403_FORBIDDEN
+            )
+        return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
 
-    def __handle_open_file(self, file_path: str) -> HttpResponse | Response:
-        if os.path.exists(file_path):
-            with open(file_path, "rb") as f:
-                image_data = f.read()
-                return HttpResponse(image_data, content_type="image/jpeg")
-        return Response({"error": "Image not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    def get(self, request: Request, user_pk: str, file_name: str) -> Response:
-        if not self.__authorize_user(request, user_pk):
-            return Response(
-                {"error": "You do not have access to this image"},
+async def authenticated_user(request: HttpRequest) -> User | None:
+    """
+    Loads the user of the API token or of the session for an async view, replacing the lazy `request.user`,
+    which cannot be evaluated on the event loop. Returns None for anonymous requests and invalid tokens.
+    """
+    try:
+        token = bearer_token(request)
+        if token is not None:
+            request.user = await sync_to_async(token_user)(token)
+            return request.user
+    except AuthenticationFailed:
+        return None
+    request.user = await sync_to_async(get_user)(request)
+    return request.user if request.user.is_authenticated else None
+
+
+class AsyncOpenImageView(View):
+    """
+    Asynchronous `OpenImageView`, served natively by ASGI servers.
+    Lookups use the async ORM and files are streamed by an async iterator, so a request holds no thread
+    while the client downloads. Thumbnails of any size are still rendered in a worker thread.
+    """
+
+    async def get(self, request: HttpRequest, user_pk: int, file_name: str) -> HttpResponse:
+        user = await authenticated_user(request)
+        if user is None:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided."},
                 status=status.HTTP_403_FORBIDDEN,
             )
-        file_path = self.__get_file_path(request, file_name)
-        return self.__handle_open_file(file_path)
+        media = await aresolve(open_image(request, user, user_pk, file_name, request.GET))
+        return await amedia_response(request, media)
+
+
+class AsyncExpiringImageView(View):
+    """
+    Asynchronous `ExpiringImageView`, served natively by ASGI servers.
+    """
+
+    async def get(self, request: HttpRequest, file_name: str) -> HttpResponse:
+        return await amedia_response(request, await aresolve(expiring_image(file_name)))
+
+
+class AsyncSignedImageView(View):
+    """
+    Asynchronous `SignedImageView`, served natively by ASGI servers.
+    """
+
+    async def get(self, request: HttpRequest, token: str, file_name: str) -> HttpResponse:
+        return await amedia_response(request, await aresolve(signed_image(token, file_name)))
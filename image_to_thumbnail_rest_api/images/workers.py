@@ -0,0 +1,31 @@
+from django.db import connections
+
+from .metrics import REGISTRY
+from .tasks import process_thumbnail_job
+
+
+def close_connections():
+    """
+    Worker processes must not share the database connection inherited from the parent.
+    """
+    connections.close_all()
+
+
+def init_worker():
+    """
+    Initializer of the process pools rendering thumbnail jobs.
+    """
+    close_connections()
+    # Metrics inherited from the parent were already counted there.
+    REGISTRY.snapshot(reset=True)
+
+
+def run_job(job_id: int) -> tuple:
+    """
+    Processes the job in a pool process. Returns its status along with the metrics it recorded,
+    to be merged into the parent's registry.
+    """
+    try:
+        return process_thumbnail_job(job_id), REGISTRY.snapshot(reset=True)
+    finally:
+        close_connections()
@@ -1,7 +1,9 @@
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase
 
-from users.models import User
+from users.models import Tier, User
+from users.tiers import get_tier
+from users.tokens import get_token_user, is_revoked
 
 
 class UserTests(APITestCase):
@@ -15,3 +17,65 @@ class UserTests(APITestCase):
     def test_login_should_return_404_for_not_existing_user(self):
         response = self.client.post('/users/login/', {'username': 'wrong_name', 'password': 'wrong_password'})
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tier_is_cached_until_saved(self):
+        tier = Tier.objects.create(
+            name="Basic",
+            thumbnail_heights=[200],
+            presence_of_original_file_link=False,
+            ability_to_fetch_expiring_link=False,
+        )
+        with self.assertNumQueries(1):
+            get_tier(tier.pk)
+            get_tier(tier.pk)
+        tier.thumbnail_heights = [300]
+        tier.save()
+        self.assertEqual(get_tier(tier.pk).thumbnail_heights, [300])
+
+    def test_session_user_is_loaded_with_its_tier(self):
+        user = User.objects.get(username="some_name")
+        user.tier = Tier.objects.create(
+            name="Basic",
+            thumbnail_heights=[200],
+            presence_of_original_file_link=False,
+            ability_to_fetch_expiring_link=False,
+        )
+        user.save()
+        self.client.force_login(user)
+        get_tier(user.tier_id)
+        with self.assertNumQueries(3):  # session, user, images
+            self.client.get('/images/')
+
+    def test_api_tokens(self):
+        """
+        Test that API tokens authenticate without session, CSRF token nor user query, until revoked
+        """
+        user = User.objects.get(username="some_name")
+        user.tier = Tier.objects.create(
+            name="Basic",
+            thumbnail_heights=[200],
+            presence_of_original_file_link=False,
+            ability_to_fetch_expiring_link=False,
+        )
+        user.save()
+        client = APIClient(enforce_csrf_checks=True)
+        response = client.post('/users/tokens/', {'username': 'some_name', 'password': 'some_password'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['token']}")
+        get_token_user(user.pk)
+        is_revoked("")  # Loads the revocations, reloaded every few seconds.
+        with self.assertNumQueries(1):  # images
+            self.assertEqual(client.get('/images/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(client.delete('/images/', {'ids': [1]}, format='json').status_code, status.HTTP_200_OK)
+
+        self.assertEqual(client.delete('/users/tokens/').status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(client.get('/images/').status_code, status.HTTP_403_FORBIDDEN)
+
+        client.credentials()
+        response = client.post('/users/tokens/', {'username': 'some_name', 'password': 'some_password'})
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['token']}")
+        self.assertEqual(client.get('/users/usage/').status_code, status.HTTP_200_OK)
+        self.assertEqual(client.delete('/users/tokens/?all=1').status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(client.get('/users/usage/').status_code, status.HTTP_403_FORBIDDEN)
+        client.credentials(HTTP_AUTHORIZATION="Bearer 1:forged:0:signature")
+        self.assertEqual(client.get('/users/usage/').status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,15 @@
+from django.contrib.auth.backends import ModelBackend
+
+from .tiers import get_tier
+
+
+class TierCachingModelBackend(ModelBackend):
+    """
+    Loads the user of a session with a single query, its tier comes from the in-process tier cache.
+    """
+
+    def get_user(self, user_id):
+        user = super().get_user(user_id)
+        if user is not None and user.tier_id is not None:
+            user.tier = get_tier(user.tier_id)
+        return user
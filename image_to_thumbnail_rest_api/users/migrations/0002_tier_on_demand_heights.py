@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tier",
+            name="on_demand_heights",
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
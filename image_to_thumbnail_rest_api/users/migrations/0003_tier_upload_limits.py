@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0002_tier_on_demand_heights"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tier",
+            name="max_upload_bytes",
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="tier",
+            name="max_upload_megapixels",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
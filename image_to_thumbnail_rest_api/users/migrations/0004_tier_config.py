@@ -0,0 +1,41 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:25
+
+from django.db import migrations, models
+
+# Thumbnail heights that were hardcoded for the built-in tiers.
+BUILTIN_TIER_HEIGHTS = {
+    "Basic": [200],
+    "Premium": [400, 200],
+    "Enterprise": [400, 200],
+}
+
+
+def fill_thumbnail_heights(apps, schema_editor):
+    Tier = apps.get_model("users", "Tier")
+    for tier in Tier.objects.all():
+        if tier.name in BUILTIN_TIER_HEIGHTS:
+            tier.thumbnail_heights = BUILTIN_TIER_HEIGHTS[tier.name]
+        elif tier.thumbnail_height:
+            tier.thumbnail_heights = [tier.thumbnail_height]
+        tier.save(update_fields=["thumbnail_heights"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0003_tier_upload_limits"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tier",
+            name="thumbnail_heights",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name="tier",
+            name="variant_formats",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_thumbnail_heights, migrations.RunPython.noop),
+    ]
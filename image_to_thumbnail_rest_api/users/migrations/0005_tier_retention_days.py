@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0004_tier_config"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tier",
+            name="retention_days",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:53
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+
+
+def count_usage(apps, schema_editor):
+    """
+    Records the size of the originals uploaded before their metadata was, from their blobs,
+    and sums up the usage of every user once.
+    """
+    Blob = apps.get_model("images", "Blob")
+    Image = apps.get_model("images", "Image")
+    User = apps.get_model("users", "User")
+    Image.objects.filter(byte_size__isnull=True, blob__isnull=False).update(
+        byte_size=Subquery(Blob.objects.filter(pk=OuterRef("blob_id")).values("byte_size")[:1])
+    )
+    usage = Image.objects.values("user_id").annotate(storage_bytes=Sum("byte_size"), image_count=Count("pk"))
+    for row in usage.iterator():
+        User.objects.filter(pk=row["user_id"]).update(
+            storage_bytes=row["storage_bytes"] or 0, image_count=row["image_count"]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0005_tier_retention_days"),
+        ("images", "0013_image_metadata"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tier",
+            name="max_megapixels_per_hour",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="tier",
+            name="max_requests_per_minute",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="tier",
+            name="max_storage_bytes",
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="image_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="storage_bytes",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(count_usage, migrations.RunPython.noop),
+    ]
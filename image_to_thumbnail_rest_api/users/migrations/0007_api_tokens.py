@@ -0,0 +1,34 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0006_quotas"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RevokedToken",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("token_id", models.CharField(max_length=32, unique=True)),
+                ("expires_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="tokens_valid_after",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
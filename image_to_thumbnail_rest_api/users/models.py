@@ -10,6 +10,11 @@ class User(AbstractUser):
     username = models.CharField(max_length=255, unique=True)
     password = models.CharField(max_length=255)
     tier = models.ForeignKey("Tier", on_delete=models.CASCADE, null=True)
+    # Usage of the storage quota, kept up to date on upload and deletion rather than summed over the images.
+    storage_bytes = models.PositiveBigIntegerField(default=0)
+    image_count = models.PositiveIntegerField(default=0)
+    # API tokens issued before this time are revoked.
+    tokens_valid_after = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.username
@@ -21,11 +26,38 @@ class Tier(models.Model):
     """
 
     name = models.CharField(max_length=255)
+    # Heights of the thumbnails generated on upload, thumbnail_height is only used when the list is empty.
+    thumbnail_heights = models.JSONField(default=list, blank=True)
     thumbnail_height = models.IntegerField(
         null=True, blank=True
     )
+    # Formats thumbnails are additionally encoded in, IMAGES_VARIANT_FORMATS when not set.
+    variant_formats = models.JSONField(null=True, blank=True)
     presence_of_original_file_link = models.BooleanField()
     ability_to_fetch_expiring_link = models.BooleanField()
+    on_demand_heights = models.JSONField(default=list, blank=True)
+    # Upload limits, the IMAGES_UPLOAD_MAX_* settings apply when empty.
+    max_upload_bytes = models.PositiveBigIntegerField(null=True, blank=True)
+    max_upload_megapixels = models.PositiveIntegerField(null=True, blank=True)
+    # Images are deleted this many days after their upload, kept forever when empty.
+    retention_days = models.PositiveIntegerField(null=True, blank=True)
+    # Rate limits and quotas, the IMAGES_QUOTA_* settings apply when empty.
+    max_requests_per_minute = models.PositiveIntegerField(null=True, blank=True)
+    max_megapixels_per_hour = models.PositiveIntegerField(null=True, blank=True)
+    max_storage_bytes = models.PositiveBigIntegerField(null=True, blank=True)
 
     def __str__(self):
         return self.name
+
+
+class RevokedToken(models.Model):
+    """
+    This model is used to store the API tokens revoked before their expiry, by token id.
+    Rows are no longer needed once the token has expired.
+    """
+
+    token_id = models.CharField(max_length=32, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.token_id
@@ -0,0 +1,154 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from rest_framework.throttling import BaseThrottle
+
+from .models import Tier, User
+
+# Lengths (in seconds) of the windows the rate limits are counted over.
+MINUTE = 60
+HOUR = 60 * 60
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when an upload would go over a quota of the user's tier.
+    `retry_after` is the number of seconds until the quota frees up, None when waiting does not help.
+    """
+
+    def __init__(self, message: str, retry_after: int = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def quota_limits(tier: Tier | None) -> dict:
+    """
+    Returns the requests per minute, megapixels per hour and storage bytes allowed to users of the tier,
+    None for no limit. Tiers without limits of their own get the IMAGES_QUOTA_* settings.
+    """
+    return {
+        "requests_per_minute": getattr(tier, "max_requests_per_minute", None)
+        or settings.IMAGES_QUOTA_REQUESTS_PER_MINUTE,
+        "megapixels_per_hour": getattr(tier, "max_megapixels_per_hour", None)
+        or settings.IMAGES_QUOTA_MEGAPIXELS_PER_HOUR,
+        "storage_bytes": getattr(tier, "max_storage_bytes", None) or settings.IMAGES_QUOTA_STORAGE_BYTES,
+    }
+
+
+def _window(name: str, user_id: int, period: int) -> tuple:
+    """
+    Returns the cache key of the user's counter for the current fixed window, and the seconds until the window ends.
+    """
+    now = time.time()
+    return f"images:quota:{name}:{user_id}:{int(now // period)}", max(1, math.ceil(period - now % period))
+
+
+def _increment(key: str, amount: int, timeout: int) -> int:
+    # Atomic with cache backends incrementing in place (redis, locmem), a single operation on a hit.
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key, amount)
+    except ValueError:
+        # Expired between the two calls.
+        cache.set(key, amount, timeout)
+        return amount
+
+
+def _count(name: str, user_id: int, period: int, amount: int, limit: int | None) -> int | None:
+    """
+    Counts `amount` against the user's counter for the current window, None standing for no limit.
+    Returns the seconds until the window ends if the limit is exceeded, the amount not being counted, None otherwise.
+    Usage is counted without limit too, to be reported.
+    """
+    key, remaining = _window(name, user_id, period)
+    if _increment(key, amount, remaining + 1) <= (math.inf if limit is None else limit):
+        return None
+    cache.decr(key, amount)
+    return remaining
+
+
+class TierRateThrottle(BaseThrottle):
+    """
+    Limits the requests of each user to the requests per minute of their tier, over fixed one-minute windows.
+    """
+
+    def allow_request(self, request, view) -> bool:
+        if not request.user or not request.user.is_authenticated:
+            return True
+        limit = quota_limits(request.user.tier)["requests_per_minute"]
+        self.retry_after = _count("requests", request.user.pk, MINUTE, 1, limit)
+        return self.retry_after is None
+
+    def wait(self) -> int | None:
+        return self.retry_after
+
+
+def reserve_upload(user: User, pixels: int, byte_size: int):
+    """
+    Counts an upload against the megapixels per hour and the storage quota of the user's tier.
+    The storage usage is updated with a single conditional update of the user.
+    Raises QuotaExceeded, counting nothing, when the upload would go over a quota.
+    """
+    limits = quota_limits(user.tier)
+    megapixels = limits["megapixels_per_hour"]
+    retry_after = _count("pixels", user.pk, HOUR, pixels, megapixels and megapixels * 1_000_000)
+    if retry_after is not None:
+        raise QuotaExceeded(f"Uploads are limited to {megapixels} megapixels per hour", retry_after)
+    users = User.objects.filter(pk=user.pk)
+    if limits["storage_bytes"] is not None:
+        users = users.filter(storage_bytes__lte=limits["storage_bytes"] - byte_size)
+    if not users.update(storage_bytes=F("storage_bytes") + byte_size, image_count=F("image_count") + 1):
+        release_upload(user.pk, pixels, 0, images=0)
+        raise QuotaExceeded(f"Storage is limited to {limits['storage_bytes']} bytes")
+
+
+def release_upload(user_id: int, pixels: int, byte_size: int, images: int = 1):
+    """
+    Gives back what `reserve_upload` counted, for an upload that failed.
+    """
+    if pixels:
+        key, _ = _window("pixels", user_id, HOUR)
+        try:
+            cache.decr(key, pixels)
+        except ValueError:
+            pass
+    release_storage(user_id, byte_size, images)
+
+
+def release_storage(user_id: int, byte_size: int, images: int = 1):
+    """
+    Takes deleted images off the user's storage usage.
+    """
+    if byte_size or images:
+        User.objects.filter(pk=user_id).update(
+            storage_bytes=Greatest(F("storage_bytes") - byte_size, Value(0)),
+            image_count=Greatest(F("image_count") - images, Value(0)),
+        )
+
+
+def usage(user: User) -> dict:
+    """
+    Returns the usage of each quota of the user, with its limit and, for rate limits, the seconds until it resets.
+    Storage usage is read from the user as loaded, the caller reloads it if needed.
+    """
+    limits = quota_limits(user.tier)
+    requests_key, requests_reset = _window("requests", user.pk, MINUTE)
+    pixels_key, pixels_reset = _window("pixels", user.pk, HOUR)
+    return {
+        "requests_per_minute": {
+            "used": cache.get(requests_key, 0),
+            "limit": limits["requests_per_minute"],
+            "resets_in": requests_reset,
+        },
+        "megapixels_per_hour": {
+            "used": round(cache.get(pixels_key, 0) / 1_000_000, 2),
+            "limit": limits["megapixels_per_hour"],
+            "resets_in": pixels_reset,
+        },
+        "storage_bytes": {"used": user.storage_bytes, "limit": limits["storage_bytes"]},
+        "images": user.image_count,
+    }
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Tier, User
+from .tiers import evict_tier
+from .tokens import evict_token_user
+
+
+@receiver(post_save, sender=Tier)
+@receiver(post_delete, sender=Tier)
+def evict_cached_tier(sender, instance: Tier, **kwargs):
+    """
+    Drops the cached copy of a changed tier.
+    """
+    evict_tier(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_cached_token_user(sender, instance: User, **kwargs):
+    """
+    Drops the cached copy of a changed user of API tokens.
+    """
+    evict_token_user(instance.pk)
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+
+from .models import Tier
+
+# Tiers by pk, with the monotonic time their entry expires at. Shared by the threads of the process.
+_tiers = {}
+
+
+def get_tier(pk: int | None) -> Tier | None:
+    """
+    Returns the tier from the in-process cache, loading it on a miss.
+    Tiers saved or deleted in this process are evicted at once, other processes see the change
+    after IMAGES_TIER_CACHE_TIMEOUT seconds. Cached tiers are shared and must not be modified.
+    """
+    if pk is None:
+        return None
+    now = time.monotonic()
+    entry = _tiers.get(pk)
+    if entry is None or entry[1] <= now:
+        tier = Tier.objects.filter(pk=pk).first()
+        if tier is None:
+            _tiers.pop(pk, None)
+            return None
+        entry = _tiers[pk] = (tier, now + settings.IMAGES_TIER_CACHE_TIMEOUT)
+    return entry[0]
+
+
+def evict_tier(pk: int):
+    _tiers.pop(pk, None)
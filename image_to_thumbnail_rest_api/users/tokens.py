@@ -0,0 +1,144 @@
+import secrets
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+
+from .models import RevokedToken, User
+from .tiers import get_tier
+
+SALT = "users.api-token"
+KEYWORD = "Bearer"
+
+# Users of API tokens by pk, with the monotonic time their entry expires at. Shared by the threads of the process.
+_users = {}
+# Ids of the revoked tokens not expired yet, with the monotonic time they are reloaded at.
+_revoked = {"token_ids": frozenset(), "expires_at": 0.0}
+
+
+def issue_token(user: User) -> tuple:
+    """
+    Returns a signed API token of the user, along with its expiry timestamp.
+    Nothing is stored: tokens are checked from their signature, until they expire or are revoked.
+    """
+    issued_at = int(time.time())
+    token = signing.Signer(salt=SALT).sign(f"{user.pk}:{secrets.token_urlsafe(12)}:{issued_at}")
+    return token, issued_at + settings.IMAGES_API_TOKEN_MAX_AGE
+
+
+def verify_token(token: str) -> tuple:
+    """
+    Checks the signature and expiry of an API token, returns the user pk, token id and issue timestamp.
+    Raises signing.BadSignature for tampered tokens and signing.SignatureExpired for expired ones.
+    """
+    try:
+        user_pk, token_id, issued_at = signing.Signer(salt=SALT).unsign(token).split(":")
+        user_pk, issued_at = int(user_pk), int(issued_at)
+    except ValueError:
+        raise signing.BadSignature("Malformed token")
+    if issued_at + settings.IMAGES_API_TOKEN_MAX_AGE <= time.time():
+        raise signing.SignatureExpired("Token has expired")
+    return user_pk, token_id, issued_at
+
+
+def get_token_user(pk: int) -> User | None:
+    """
+    Returns the active user from the in-process cache, loading it (and its tier from the tier cache) on a miss.
+    Users saved or deleted in this process are evicted at once, other processes see the change
+    after IMAGES_TIER_CACHE_TIMEOUT seconds. Cached users are shared and must not be modified.
+    """
+    now = time.monotonic()
+    entry = _users.get(pk)
+    if entry is None or entry[1] <= now:
+        user = User.objects.filter(pk=pk, is_active=True).first()
+        if user is None:
+            _users.pop(pk, None)
+            return None
+        if user.tier_id is not None:
+            user.tier = get_tier(user.tier_id)
+        entry = _users[pk] = (user, now + settings.IMAGES_TIER_CACHE_TIMEOUT)
+    return entry[0]
+
+
+def evict_token_user(pk: int):
+    _users.pop(pk, None)
+
+
+def is_revoked(token_id: str) -> bool:
+    """
+    Tells whether the token was revoked, from the revocations reloaded every IMAGES_API_TOKEN_REVOCATIONS_REFRESH seconds.
+    """
+    now = time.monotonic()
+    if _revoked["expires_at"] <= now:
+        _revoked["token_ids"] = frozenset(
+            RevokedToken.objects.filter(expires_at__gt=timezone.now()).values_list("token_id", flat=True)
+        )
+        _revoked["expires_at"] = now + settings.IMAGES_API_TOKEN_REVOCATIONS_REFRESH
+    return token_id in _revoked["token_ids"]
+
+
+def revoke_token(token: str):
+    """
+    Revokes the token, at once in this process and within IMAGES_API_TOKEN_REVOCATIONS_REFRESH seconds in the others.
+    Revocations of expired tokens are deleted on the way.
+    """
+    _, token_id, issued_at = verify_token(token)
+    expires_at = datetime.fromtimestamp(issued_at + settings.IMAGES_API_TOKEN_MAX_AGE, tz=dt_timezone.utc)
+    RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+    RevokedToken.objects.get_or_create(token_id=token_id, defaults={"expires_at": expires_at})
+    _revoked["token_ids"] = _revoked["token_ids"] | {token_id}
+
+
+def token_user(token: str) -> User:
+    """
+    Returns the user of a valid API token. Raises AuthenticationFailed otherwise.
+    """
+    try:
+        user_pk, token_id, issued_at = verify_token(token)
+    except signing.SignatureExpired:
+        raise AuthenticationFailed("Token has expired")
+    except signing.BadSignature:
+        raise AuthenticationFailed("Invalid token")
+    user = get_token_user(user_pk)
+    if user is None or is_revoked(token_id):
+        raise AuthenticationFailed("Invalid token")
+    if user.tokens_valid_after and issued_at < user.tokens_valid_after.timestamp():
+        raise AuthenticationFailed("Invalid token")
+    return user
+
+
+def bearer_token(request) -> str | None:
+    """
+    Returns the token of an `Authorization: Bearer <token>` header, None without one.
+    """
+    auth = get_authorization_header(request).split()
+    if not auth or auth[0].lower() != KEYWORD.lower().encode():
+        return None
+    if len(auth) != 2:
+        raise AuthenticationFailed("Invalid token header")
+    try:
+        return auth[1].decode()
+    except UnicodeError:
+        raise AuthenticationFailed("Invalid token header")
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Authenticates requests with `Authorization: Bearer <token>` API tokens, without session nor CSRF checks.
+    Tokens are checked from their signature, their user and revocations come from in-process caches,
+    so a request usually makes no query to authenticate.
+    """
+
+    def authenticate(self, request: Request) -> tuple | None:
+        token = bearer_token(request)
+        if token is None:
+            return None
+        return token_user(token), token
+
+    def authenticate_header(self, request: Request) -> str:
+        return KEYWORD
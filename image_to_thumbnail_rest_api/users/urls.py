@@ -1,8 +1,10 @@
 
 from django.urls import path
 
-from .views import LoginView
+from .views import LoginView, TokenView, UsageView
 
 urlpatterns = [
     path("login/", LoginView.as_view(), name="login-view"),
+    path("tokens/", TokenView.as_view(), name="token-view"),
+    path("usage/", UsageView.as_view(), name="usage-view"),
 ]
@@ -1,9 +1,19 @@
+from datetime import datetime
+
 from django.contrib.auth import authenticate, login
 from django.shortcuts import render
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from .models import User
+from .quotas import TierRateThrottle, usage
+from .tokens import SignedTokenAuthentication, evict_token_user, issue_token, revoke_token
+
 
 class LoginView(APIView):
     def post(self, request, format=None):
@@ -26,4 +36,63 @@ class LoginView(APIView):
                 return Response(data, status=status.HTTP_404_NOT_FOUND)
         else:
             data = {'failure': 'User not found'}
-            return Response(data, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+            return Response(data, status=status.HTTP_404_NOT_FOUND)
+
+
+class TokenView(APIView):
+    """
+    API tokens, for clients authenticating with `Authorization: Bearer <token>` instead of a session.
+    """
+
+    authentication_classes = [SessionAuthentication, SignedTokenAuthentication]
+    permission_classes = [AllowAny]
+
+    def post(self, request: Request) -> Response:
+        """
+        Issues a token to the user of the given username and password, or to the authenticated user.
+        """
+        user = request.user
+        if "username" in request.data:
+            user = authenticate(username=request.data.get("username"), password=request.data.get("password"))
+        if user is None or not user.is_authenticated or not user.is_active:
+            return Response({"failure": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+        token, expires_at = issue_token(user)
+        return Response(
+            {"token": token, "expires_at": datetime.fromtimestamp(expires_at, tz=timezone.get_current_timezone())},
+            status=status.HTTP_201_CREATED,
+        )
+
+    def delete(self, request: Request) -> Response:
+        """
+        Revokes the token the request is authenticated with, or every token of the user with `all`.
+        """
+        if not request.user.is_authenticated:
+            return Response(
+                {"error": "Authentication credentials were not provided"}, status=status.HTTP_403_FORBIDDEN
+            )
+        if request.query_params.get("all") or request.data.get("all"):
+            User.objects.filter(pk=request.user.pk).update(tokens_valid_after=timezone.now())
+            evict_token_user(request.user.pk)
+        elif isinstance(request.successful_authenticator, SignedTokenAuthentication):
+            revoke_token(request.auth)
+        else:
+            return Response(
+                {"error": "The request is not authenticated with a token"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UsageView(APIView):
+    """
+    Usage of the rate limits and quotas of the user's tier.
+    """
+
+    authentication_classes = [SessionAuthentication, SignedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [TierRateThrottle]
+
+    def get(self, request: Request) -> Response:
+        # Users of API tokens come from a cache, storage usage is read afresh.
+        user = User.objects.only("storage_bytes", "image_count").get(pk=request.user.pk)
+        user.tier = request.user.tier
+        return Response(usage(user), status=status.HTTP_200_OK)